@@ -2,9 +2,10 @@
 
 import os
 import gc
-import time
 import gzip
+import time
 import pickle
+import functools
 import random
 import logging
 import collections as cl
@@ -13,10 +14,11 @@ import multiprocessing.shared_memory as shm
 
 import numpy as np
 import pandas as pd
-import scipy.sparse as sp
 
 from tqdm import tqdm
 
+from edge_store import EdgeStore
+
 
 logger = logging.getLogger(__name__)
 
@@ -52,73 +54,253 @@ def access_shared_memory(spec):
     return shr, arr
 
 
-def key_to_filename(out_dir, key):
-    out_path_base = [int(s) if isinstance(s, float) else s for s in key]
-    out_path_base = [str(s) for s in out_path_base]
-    out_path_base = '-'.join(out_path_base) + '.csv.gz'
-    out_path = os.path.join(out_dir, out_path_base)
-
-    return out_path
-
-
-def sims_over_thresh(a, thresh, chunk_size=1000):
-    m, n = a.shape
+def sims_over_thresh(a, thresh, chunk_size=1000, dtype=np.float32, acc_dtype=None,
+                     n_rows=None):
+    # (i, j, sim) for each pair of rows i < j with sim >= thresh, sorted by
+    # (i, j); with n_rows, only pairs with i < n_rows. a @ a.T is
+    # symmetric, so only the chunk_size blocks on or above the diagonal
+    # are computed, in dtype (the embeddings' own float32) or in acc_dtype
+    # if given, e.g. np.float64 for more precise sums. sims are returned
+    # as float64, as they were written before.
+    a = np.asarray(a, dtype=dtype)
+    acc_dtype = acc_dtype or dtype
+    m = a.shape[0]
+    n_rows = m if n_rows is None else n_rows
 
     i_vals, j_vals, v_vals = [], [], []
 
-    for c in range(0, m, chunk_size):
-        chunk = a[c:(c+chunk_size), :]
-        sims = chunk @ a.T
+    for r in range(0, n_rows, chunk_size):
+        rows = a[r:min(r + chunk_size, n_rows), :].astype(acc_dtype, copy=False)
 
-        i, j = np.where(sims >= thresh)
-        v = sims[i, j]
-        i += c
+        row_i, row_j, row_v = [], [], []
+        for c in range(r, m, chunk_size):
+            sims = rows @ a[c:(c+chunk_size), :].T.astype(acc_dtype, copy=False)
 
-        i_vals += [i]
-        j_vals += [j]
-        v_vals += [v]
+            i, j = np.nonzero(sims >= thresh)
+            i, j, v = i + r, j + c, sims[i, j]
 
-    i_vals = np.concatenate(i_vals)
-    j_vals = np.concatenate(j_vals)
-    v_vals = np.concatenate(v_vals)
+            if c == r:  # don't want self edges or the lower half
+                keep = j > i
+                i, j, v = i[keep], j[keep], v[keep]
 
-    values = sp.coo_array((v_vals, (i_vals, j_vals)), shape=(m, m), dtype=np.float64)
-    values = values.asformat('csr')
-    values = sp.triu(values, 1)  # matrix is symmetric + don't want self edges
+            row_i += [i]
+            row_j += [j]
+            row_v += [v]
 
-    return values
+        # each block is in (i, j) order; interleave them by row
+        i, j, v = map(np.concatenate, (row_i, row_j, row_v))
+        order = np.argsort(i, kind='stable')
 
+        i_vals += [i[order]]
+        j_vals += [j[order]]
+        v_vals += [v[order]]
 
-def wrapper(out_dir, key, embs_shr_spec, ids_shr_spec, year_mask, mask,
-            *args, **kwargs):
-    year, kind, start, end = key
-    out_path = key_to_filename(out_dir, key)
+    i_vals = np.concatenate(i_vals)
+    j_vals = np.concatenate(j_vals)
+    v_vals = np.concatenate(v_vals).astype(np.float64)
+
+    return i_vals, j_vals, v_vals
+
+
+ANN_BACKENDS = {'ivf', 'ivfpq', 'hnsw'}
+
+# below this many rows in a band, building an index doesn't pay
+ANN_MIN_ROWS = 10000
+
+
+def time_bands(reltimes, block_len, n_blocks):
+    # reltimes: sorted. Splits them into blocks of block_len seconds and
+    # returns (start, end, band_end) for each nonempty block: its rows
+    # start:end are joined with rows start:band_end, everything up to
+    # n_blocks blocks later. That's exactly the pairs some window
+    # [s, s + n_blocks] of blocks used to cover, but each pair comes up
+    # once, in the band of its earlier snippet.
+    reltimes = np.asarray(reltimes, dtype=np.float64)
+    if reltimes.shape[0] == 0:
+        return []
+
+    total = max(int(np.ceil(reltimes[-1] / block_len)), 1)
+    blocks = np.minimum(np.floor(reltimes / block_len), total - 1)
+
+    b = np.arange(total)
+    starts = np.searchsorted(blocks, b, side='left')
+    ends = np.searchsorted(blocks, b, side='right')
+    band_ends = np.searchsorted(reltimes, (b + n_blocks) * block_len, side='right')
+
+    return [
+        (int(s), int(e), int(be))
+        for s, e, be in zip(starts, ends, band_ends)
+        if e > s
+    ]
+
+
+def ann_sims_over_thresh(a, thresh, n_rows=None, backend='ivf', margin=0.02,
+                         min_rows=ANN_MIN_ROWS, nlist=None, nprobe=16, pq_m=None,
+                         hnsw_m=32, ef_search=256, query_size=1000, rescore_size=2**20,
+                         **kwargs):
+    # sims_over_thresh() through a faiss index: 'ivf' (IVF-flat), 'ivfpq'
+    # (IVF with product-quantized codes, whose scores are coarse, so give
+    # it a wider margin) or 'hnsw'. Every pair the index scores above
+    # thresh - margin is rescored exactly and kept if it's >= thresh, so
+    # the result is a subset of the exact one. Below min_rows building an
+    # index doesn't pay and the exact kernel is used.
+    import faiss  # only needed for the ANN backends
+
+    if backend not in ANN_BACKENDS:
+        raise ValueError(f'Unsupported ANN backend {backend}')
+
+    a = np.ascontiguousarray(a, dtype=np.float32)
+    m, d = a.shape
+    n_rows = m if n_rows is None else n_rows
+
+    if m < min_rows:
+        return sims_over_thresh(a, thresh, n_rows=n_rows, **kwargs)
+
+    if backend == 'hnsw':
+        index = faiss.IndexHNSWFlat(d, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efSearch = ef_search
+    else:
+        nlist = nlist or int(np.sqrt(m))
+        quantizer = faiss.IndexFlatIP(d)
+        if backend == 'ivfpq':
+            index = faiss.IndexIVFPQ(quantizer, d, nlist, pq_m or d // 8, 8,
+                                     faiss.METRIC_INNER_PRODUCT)
+        else:
+            index = faiss.IndexIVFFlat(quantizer, d, nlist, faiss.METRIC_INNER_PRODUCT)
+        index.train(a)
+        index.nprobe = nprobe
+    index.add(a)
+
+    # in batches of queries; faiss's HNSW range search fails on big ones
+    i_vals, j_vals = [], []
+    for r in range(0, n_rows, query_size):
+        lims, _, j = index.range_search(a[r:min(r + query_size, n_rows), :],
+                                        thresh - margin)
+        i = r + np.repeat(np.arange(lims.shape[0] - 1), np.diff(lims).astype(np.int64))
+
+        keep = j > i  # as in sims_over_thresh, only the upper half
+        i_vals += [i[keep]]
+        j_vals += [j[keep]]
+
+    i, j = np.concatenate(i_vals), np.concatenate(j_vals)
+
+    v = np.concatenate([np.zeros(0, dtype=np.float32)] + [
+        np.einsum('ij,ij->i', a[i[k:(k+rescore_size)]], a[j[k:(k+rescore_size)]])
+        for k in range(0, i.shape[0], rescore_size)
+    ])
+
+    keep = v >= thresh
+    i, j, v = i[keep], j[keep], v[keep]
+    order = np.lexsort((j, i))
+
+    return i[order], j[order], v[order].astype(np.float64)
+
+
+def band_sims(embs_shr_spec, thresh, task, backend='exact', ann_kwargs=None,
+              **kwargs):
+    # task: (rows, n_rows, check), a band's embedding rows in time order,
+    # how many of them are its block's and whether to check an ANN
+    # backend's recall against the exact kernel. Returns (i, j, sim) as
+    # embedding rows, and the recall check's counts or None; bands too
+    # small for an index were run exactly, so they're never checked.
+    rows, n_rows, check = task
+    min_rows = (ann_kwargs or {}).get('min_rows', ANN_MIN_ROWS)
 
     embs_shr, embs_arr = access_shared_memory(embs_shr_spec)
-    ids_shr, ids_arr = access_shared_memory(ids_shr_spec)
-    embs_arr = embs_arr[year_mask & mask, :]
-
-    sims = sims_over_thresh(embs_arr, thresh, *args, **kwargs)
-    i, j, v = sp.find(sims)
-
-    edges = pd.concat([
-        pd.Series(ids_arr[year_mask, ...][mask][i]) \
-            .rename('source').reset_index(drop=True),
+    try:
+        a = embs_arr[rows, :]
+    finally:
+        del embs_arr
+        embs_shr.close()
 
-        pd.Series(ids_arr[year_mask, ...][mask][j]) \
-            .rename('target').reset_index(drop=True),
+    if backend == 'exact':
+        i, j, v = sims_over_thresh(a, thresh, n_rows=n_rows, **kwargs)
+        return rows[i], rows[j], v, None
+
+    t0 = time.perf_counter()
+    i, j, v = ann_sims_over_thresh(a, thresh, n_rows=n_rows, backend=backend,
+                                   **(ann_kwargs or {}), **kwargs)
+    t1 = time.perf_counter()
+
+    stats = None
+    if check and rows.shape[0] >= min_rows:
+        ei, ej, _ = sims_over_thresh(a, thresh, n_rows=n_rows, **kwargs)
+        t2 = time.perf_counter()
+
+        m = a.shape[0]
+        stats = {
+            'n_exact': ei.shape[0],
+            'n_ann': i.shape[0],
+            'n_found': int(np.isin(ei * m + ej, i * m + j).sum()),
+            'ann_secs': t1 - t0,
+            'exact_secs': t2 - t1,
+        }
+
+    return rows[i], rows[j], v, stats
+
+
+def banded_edges(pool, embs_shr_spec, rows, reltimes, thresh, block_len,
+                 n_blocks, backend='exact', recall_sample=0.05, seed=None,
+                 ann_kwargs=None, **kwargs):
+    # every pair of rows within n_blocks blocks of each other, once, as
+    # (source, target, sim) embedding rows with source < target. With an
+    # ANN backend, a recall_sample share of the bands that go through the
+    # index (at least one) is also run exactly, and how many bands were
+    # indexed and the recall stats are returned; else None.
+    order = np.argsort(reltimes, kind='stable')
+    rows, reltimes = rows[order], reltimes[order]
+
+    bands = time_bands(reltimes, block_len, n_blocks)
+
+    # smaller bands fall back to the exact kernel; checking them would
+    # compare it with itself
+    min_rows = (ann_kwargs or {}).get('min_rows', ANN_MIN_ROWS)
+    indexed = np.array([band_end - start >= min_rows for start, _, band_end in bands],
+                       dtype=bool)
+
+    check = np.zeros(len(bands), dtype=bool)
+    if backend != 'exact' and indexed.any():
+        rng = np.random.default_rng(seed)
+        check = indexed & (rng.random(len(bands)) < recall_sample)
+        check[rng.choice(np.flatnonzero(indexed))] = True
+
+    tasks = [
+        (rows[start:band_end], end - start, c)
+        for (start, end, band_end), c in zip(bands, check)
+    ]
+
+    func = functools.partial(band_sims, embs_shr_spec, thresh, backend=backend,
+                             ann_kwargs=ann_kwargs, **kwargs)
+
+    i_vals, j_vals, v_vals, checks = [], [], [], []
+    for i, j, v, stats in tqdm(pool.imap_unordered(func, tasks), total=len(tasks)):
+        i_vals += [i]
+        j_vals += [j]
+        v_vals += [v]
+        if stats is not None:
+            checks += [stats]
 
-        pd.Series(v).rename('sim'),
-    ], axis=1).assign(year=year, kind=kind)
+    i = np.concatenate(i_vals or [np.zeros(0, dtype=rows.dtype)])
+    j = np.concatenate(j_vals or [np.zeros(0, dtype=rows.dtype)])
+    v = np.concatenate(v_vals or [np.zeros(0)])
 
-    with gzip.open(out_path, 'wt') as f:
-        edges.to_csv(f, index=False)
+    # source before target in the data's order, as the windows wrote them
+    i, j = np.minimum(i, j), np.maximum(i, j)
+    order = np.lexsort((j, i))
 
-    del embs_arr, ids_arr
-    embs_shr.close()
-    ids_shr.close()
+    recall = None
+    if backend != 'exact':
+        keys = ['n_exact', 'n_ann', 'n_found', 'ann_secs', 'exact_secs']
+        recall = {k: sum(c[k] for c in checks) for k in keys}
+        recall.update({
+            'n_bands': len(bands),
+            'n_indexed': int(indexed.sum()),
+            'n_checked': len(checks),
+            'recall': recall['n_found'] / recall['n_exact'] if recall['n_exact'] else np.nan,
+            'speedup': recall['exact_secs'] / recall['ann_secs'] if checks else np.nan,
+        })
 
-    return key
+    return i[order], j[order], v[order], recall
 
 
 if __name__ == '__main__':
@@ -132,13 +314,20 @@ if __name__ == '__main__':
 
     os.chdir(os.path.expanduser('~/github/masthesis/'))
 
-    CACHE_DIR = 'data/paper-round-3/event-annotated/auto-sample-sim-edges/'
-    os.makedirs(CACHE_DIR, exist_ok=True)
+    EDGE_STORE = 'data/paper-round-3/event-annotated/auto-sample-sim-edges.store/'
+
+    RECALL_PATH = 'data/paper-round-3/event-annotated/auto-sample-sim-edges-recall.csv'
 
     ## Params
     n_blocks = 4
     block_len = 4000  # in seconds
 
+    # 'exact', or an ANN backend (needs faiss): 'ivf', 'ivfpq' or 'hnsw'
+    backend = os.environ.get('EDGE_BACKEND', 'exact')
+    if backend != 'exact' and backend not in ANN_BACKENDS:
+        raise ValueError(f'Unsupported edge backend {backend}')
+    recall_sample = 0.05  # share of bands also run exactly to check recall
+
     # just to be safe
     seed = 2969591811
     random.seed(seed)
@@ -158,9 +347,14 @@ if __name__ == '__main__':
 
     logger.debug('loaded embs')
 
+    if EdgeStore.exists(EDGE_STORE):
+        store = EdgeStore.open(EDGE_STORE)
+        assert (np.asarray(store.nodes) == dat['id'].to_numpy()).all()
+    else:
+        store = EdgeStore.create(EDGE_STORE, dat['id'].to_numpy())
+
     try:
         ## Set up shared memory
-        ids_shr, ids_shr_spec = copy_to_shared_memory(dat['id'].to_numpy())
         embs_shr, embs_shr_spec = copy_to_shared_memory(embs)
 
         del embs
@@ -168,77 +362,55 @@ if __name__ == '__main__':
         logger.debug('created shared memory')
 
         ## Compute edges
+        # one deduplicated edge partition per (year, kind); each pair of
+        # snippets within n_blocks blocks of each other is compared once
         num_workers = 20  # mp.cpu_count() - 1
-        for year in tqdm(dat['year'].unique()):
-            year_mask = dat['timestamp'].dt.year == year
-
-            year_kinds = dat.loc[year_mask, 'kind']
-            year_reltimes = dat.loc[year_mask, 'reltime']
-            year_reltimes -= year_reltimes.min()
+        recalls = []
+        with mp.Pool(processes=num_workers) as pool:
+            for year in tqdm(dat['year'].unique()):
+                year_mask = dat['timestamp'].dt.year == year
 
-            total = int(np.ceil((year_reltimes.max() - year_reltimes.min()) / block_len))
-            starts = pd.Series(np.arange(total)).sample(frac=1, random_state=seed)
-            ends = starts.apply(lambda p: min(p + n_blocks, total))
+                reltimes = dat['reltime'] - dat.loc[year_mask, 'reltime'].min()
 
-            for kind in tqdm(dat['kind'].unique()):
-                kind_mask = (year_kinds == kind)
+                for kind in tqdm(dat['kind'].unique()):
+                    key = (year, kind)
 
-                thresh = thresholds.loc[(thresholds['year'] == year) & (thresholds['kind'] == kind), :]
-                thresh = thresh['threshold'] - thresh['sd']  # lower threshold, more flexibility later
-                thresh = thresh.item()
-
-                with mp.Pool(processes=num_workers) as pool:
-                    results = []
-
-                    pbar = tqdm(total=len(starts))
-
-                    for start, end in zip(starts, ends):
-                        key = (year, kind, start, end)
-
-                        time_mask = (year_reltimes >= start * block_len) & (year_reltimes <= end * block_len)
-                        mask = kind_mask & time_mask
-                        if mask.sum() == 0:
-                            pbar.update(1)
+                    if store.has_partition(year, kind):
+                        if (
+                            'SKIP_EXISTING_EDGES' in os.environ.keys() and
+                            int(os.environ['SKIP_EXISTING_EDGES']) == 1
+                        ):
                             continue
-
-                        if start == starts.max() and mask.sum() < 10000:  # last batch can be small
-                            pbar.update(1)
-                            continue
-
-                        if os.path.exists(key_to_filename(CACHE_DIR, key)):
-                            if (
-                                'SKIP_EXISTING_EDGES' in os.environ.keys() and
-                                int(os.environ['SKIP_EXISTING_EDGES']) == 1
-                            ):
-                                pbar.update(1)
-                                continue
-                            else:
-                                raise RuntimeError('file exists')
-
-                        results += [pool.apply_async(
-                            wrapper,
-                            args=(CACHE_DIR, key, embs_shr_spec, ids_shr_spec,
-                                  year_mask, mask),
-                            kwds={'chunk_size': 10000},
-                        )]
-                    pool.close()
-
-                    while results:
-                        status = [r.ready() for r in results]
-                        pbar.update(sum(status))
-
-                        for res, stat in zip(results, status):
-                            if stat:
-                                res.get()  # riase if something goes wrong
-
-                        results = [r for r in results if not r.ready()]
-
-                        time.sleep(0.5)
-
-                    pool.join()
+                        else:
+                            raise RuntimeError('partition exists')
+
+                    rows = np.flatnonzero(year_mask & (dat['kind'] == kind))
+                    if rows.shape[0] == 0:
+                        continue
+
+                    thresh = thresholds.loc[(thresholds['year'] == year) & (thresholds['kind'] == kind), :]
+                    thresh = thresh['threshold'] - thresh['sd']  # lower threshold, more flexibility later
+                    thresh = thresh.item()
+
+                    i, j, v, recall = banded_edges(
+                        pool, embs_shr_spec, rows, reltimes.to_numpy()[rows],
+                        thresh, block_len, n_blocks, backend=backend,
+                        recall_sample=recall_sample, seed=seed, chunk_size=10000,
+                    )
+
+                    if recall is not None:
+                        logger.info(f'{key}: {recall["n_indexed"]} of '
+                                    f'{recall["n_bands"]} bands indexed; recall '
+                                    f'{recall["recall"]:.4f} on {recall["n_checked"]} '
+                                    f'of them, {recall["speedup"]:.1f}x faster than exact')
+                        recalls += [dict(recall, year=year, kind=kind, backend=backend)]
+
+                    # edges refer to snippets by row, as the embeddings do
+                    store.write_partition(year, kind, i, j, v, threshold=thresh,
+                                          backend=backend)
+
+        if recalls:
+            pd.DataFrame(recalls).to_csv(RECALL_PATH, index=False)
     finally:
         embs_shr.close()
-        ids_shr.close()
-
         embs_shr.unlink()
-        ids_shr.unlink()
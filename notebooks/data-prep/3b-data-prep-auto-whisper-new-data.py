@@ -4,24 +4,21 @@
 
 import os
 import gzip
-import pickle
 
 import pandas as pd
 
-from tqdm import tqdm
-
 import transcribe as tr
+from task_manifest import TaskManifest
 
 
 BASE_PATH = os.path.expanduser('~/github/masthesis/data/paper-round-3/')
 
 
 def prep_tasks():
-    TARGET = os.path.join(BASE_PATH, 'event-annotated/auto-sample-whisper-tasks-new-data.pkl')
+    TARGET = os.path.join(BASE_PATH, 'event-annotated/auto-sample-whisper-tasks-new-data.manifest')
 
-    if os.path.exists(TARGET):
-        with open(TARGET, 'rb') as f:
-            tasks = pickle.load(f)
+    if TaskManifest.exists(TARGET):
+        tasks = TaskManifest.load(TARGET)
     else:
         with gzip.open(os.path.join(BASE_PATH, 'radio/new-data-processed.csv.gz'), 'rt') as f:
             audio = pd.read_csv(f)
@@ -35,14 +32,8 @@ def prep_tasks():
             }, axis=1) \
             .sort_values('key')
 
-        with tqdm(tasks.groupby('key'), desc='Task prep') as gby:
-            tasks = {
-                key: group[['id', 'offset', 'duration']]
-                for key, group in gby
-            }
-
-        with open(TARGET, 'wb') as f:
-            pickle.dump(tasks, f)
+        TaskManifest.from_frame(tasks).save(TARGET)
+        tasks = TaskManifest.load(TARGET)
 
     return tasks
 
@@ -2,13 +2,14 @@
 
 import os
 import gzip
-import json
 import logging
 
 import pandas as pd
 
 from tqdm import tqdm
 
+from transcript_cache import open_cache
+
 
 logger = logging.getLogger(__name__)
 
@@ -23,20 +24,16 @@ if __name__ == '__main__':
 
     transcribed = []
     with tqdm() as pbar:
-        for root, dirs, files in os.walk(CACHE_DIR):
-            for file in files:
-                try:
-                    with open(os.path.join(root, file), 'rt') as f:
-                        content = json.load(f)
-
-                    transcribed += [{
-                        'snippet_id': content['id'],
-                        'content': ' '.join([s['text'] for s in content['segments']]).strip(),
-                    }]
-                except Exception as exc:
-                    logger.exception(f'Failed to read file {file}')
-                finally:
-                    pbar.update(1)
+        for key, content in open_cache(CACHE_DIR).items():
+            try:
+                transcribed += [{
+                    'snippet_id': content['id'],
+                    'content': ' '.join([s['text'] for s in content['segments']]).strip(),
+                }]
+            except Exception as exc:
+                logger.exception(f"Failed to read snippet {content.get('id')} of {key}")
+            finally:
+                pbar.update(1)
 
     with gzip.open(TARGET, 'wt') as f:
         pd.DataFrame(transcribed).to_csv(f, index=False)
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+
+# ./coordinator.py sqlite:////shared/whisper-work.sqlite
+# ./coordinator.py postgresql://user@host/db --requeue
+#
+# Hands out keys to transcription nodes through one shared table, in a
+# SQLite file on a shared filesystem or in Postgres; no other service is
+# needed. Nodes claim batches of keys under time-limited leases, renew
+# them while working and mark them done (or failed) when finished. A
+# lease that runs out, because its node died or hung, makes the key
+# claimable again, so any number of nodes drain one global queue. Run as
+# a script, prints the queue's state.
+
+import os
+import time
+import socket
+import sqlite3
+import logging
+import argparse
+import threading
+import contextlib
+from abc import ABC, abstractmethod
+from urllib.parse import urlparse
+
+
+logger = logging.getLogger(__name__)
+
+
+class Coordinator(ABC):
+    # statuses: 'todo' -> 'leased' -> 'done', or back to 'todo' if the
+    # lease runs out or the node gives the key up; 'failed' once a key
+    # has been given up on max_attempts times
+    schema = [
+        '''
+        create table if not exists work (
+            key text primary key,
+            cost double precision not null default 0,
+            status text not null default 'todo',
+            owner text,
+            lease_until double precision,
+            attempts integer not null default 0,
+            updated double precision
+        )
+        ''',
+        'create index if not exists work_status on work (status, cost)',
+    ]
+
+    # placeholder for query parameters
+    param = '?'
+
+    # keys per statement, under SQLite's bound-parameter limit
+    chunk_size = 500
+
+    def __init__(self, node_id=None, lease_secs=600.0, max_attempts=3):
+        super().__init__()
+
+        # leases are compared against each node's own clock, so they
+        # should be long next to any clock skew between nodes
+        self.node_id = node_id or f'{socket.gethostname()}-{os.getpid()}'
+        self.lease_secs = lease_secs
+        self.max_attempts = max_attempts
+
+    @abstractmethod
+    def _transaction(self):
+        # context manager yielding a cursor, committing on success
+        raise NotImplementedError()
+
+    @abstractmethod
+    def _claim(self, cur, n, now):
+        raise NotImplementedError()
+
+    def _chunks(self, keys):
+        keys = list(keys)
+        for i in range(0, len(keys), self.chunk_size):
+            yield keys[i:(i+self.chunk_size)]
+
+    def _in(self, keys):
+        return '(' + ', '.join([self.param] * len(keys)) + ')'
+
+    def create(self):
+        with self._transaction() as cur:
+            for stmt in self.schema:
+                cur.execute(stmt)
+
+    def add_keys(self, costs):
+        # costs: {key: cost}; higher-cost keys are handed out first. Keys
+        # already present keep their status, so every node can add the
+        # full key list when it starts.
+        p, now = self.param, time.time()
+        with self._transaction() as cur:
+            cur.executemany(
+                f'insert into work (key, cost, updated) values ({p}, {p}, {p}) '
+                f'on conflict (key) do nothing',
+                [(key, float(cost), now) for key, cost in costs.items()],
+            )
+
+    def claim(self, n):
+        # up to n keys, each either unclaimed or with an expired lease
+        p, now = self.param, time.time()
+        with self._transaction() as cur:
+            # a key whose lease has run out max_attempts times is given up on
+            cur.execute(
+                f"update work set status = 'failed', owner = null, "
+                f"lease_until = null, updated = {p} "
+                f"where status = 'leased' and lease_until < {p} and attempts >= {p}",
+                [now, now, self.max_attempts],
+            )
+
+            return self._claim(cur, n, now)
+
+    def renew(self, keys):
+        p, now = self.param, time.time()
+
+        n = 0
+        for chunk in self._chunks(keys):
+            with self._transaction() as cur:
+                cur.execute(
+                    f"update work set lease_until = {p}, updated = {p} "
+                    f"where status = 'leased' and owner = {p} and key in {self._in(chunk)}",
+                    [now + self.lease_secs, now, self.node_id] + chunk,
+                )
+                n += cur.rowcount
+
+        # fewer than asked means some leases ran out and were reclaimed;
+        # the work is idempotent, so both nodes finishing it is harmless
+        if n < len(keys):
+            logger.warning(f'Lost the lease on {len(keys) - n} keys')
+
+        return n
+
+    def complete(self, keys):
+        p, now = self.param, time.time()
+
+        for chunk in self._chunks(keys):
+            with self._transaction() as cur:
+                cur.execute(
+                    f"update work set status = 'done', owner = null, "
+                    f"lease_until = null, updated = {p} where key in {self._in(chunk)}",
+                    [now] + chunk,
+                )
+
+    def release(self, keys, failed=False):
+        # give keys back; failed ones stay down after max_attempts claims
+        p, now = self.param, time.time()
+
+        status = (
+            f"case when attempts >= {p} then 'failed' else 'todo' end"
+            if failed else "'todo'"
+        )
+        params = [self.max_attempts] if failed else []
+
+        for chunk in self._chunks(keys):
+            with self._transaction() as cur:
+                cur.execute(
+                    f"update work set status = {status}, owner = null, "
+                    f"lease_until = null, updated = {p} "
+                    f"where status = 'leased' and owner = {p} and key in {self._in(chunk)}",
+                    params + [now, self.node_id] + chunk,
+                )
+
+    def requeue(self):
+        # failed keys back to todo, with their attempts reset
+        p = self.param
+        with self._transaction() as cur:
+            cur.execute(
+                f"update work set status = 'todo', attempts = 0, updated = {p} "
+                f"where status = 'failed'",
+                [time.time()],
+            )
+            return cur.rowcount
+
+    def counts(self):
+        # {status: n}, with expired leases counted as 'expired'
+        p = self.param
+        with self._transaction() as cur:
+            cur.execute(
+                f"select case when status = 'leased' and lease_until < {p} "
+                f"then 'expired' else status end, count(*) from work group by 1",
+                [time.time()],
+            )
+            return dict(cur.fetchall())
+
+    def close(self):
+        pass
+
+
+class SqliteCoordinator(Coordinator):
+    def __init__(self, path, **kwargs):
+        super().__init__(**kwargs)
+
+        self.path = path
+
+        # one connection shared by this process's threads under a lock;
+        # 'begin immediate' takes the write lock up front, so two nodes
+        # can't both read the same free keys and claim them
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=600, isolation_level=None,
+                                    check_same_thread=False)
+        self.create()
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        with self._lock:
+            cur = self.conn.cursor()
+            cur.execute('begin immediate')
+            try:
+                yield cur
+            except BaseException:
+                cur.execute('rollback')
+                raise
+            else:
+                cur.execute('commit')
+            finally:
+                cur.close()
+
+    def _claim(self, cur, n, now):
+        cur.execute(
+            "select key from work "
+            "where (status = 'todo' or (status = 'leased' and lease_until < ?)) "
+            "and attempts < ? order by cost desc limit ?",
+            (now, self.max_attempts, n),
+        )
+        keys = [row[0] for row in cur.fetchall()]
+
+        if keys:
+            cur.execute(
+                f"update work set status = 'leased', owner = ?, lease_until = ?, "
+                f"attempts = attempts + 1, updated = ? where key in {self._in(keys)}",
+                [self.node_id, now + self.lease_secs, now] + keys,
+            )
+
+        return keys
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+class PostgresCoordinator(Coordinator):
+    param = '%s'
+
+    def __init__(self, dsn, **kwargs):
+        super().__init__(**kwargs)
+
+        # only needed by nodes that coordinate through Postgres
+        import psycopg2
+
+        self.dsn = dsn
+        self._lock = threading.Lock()
+        self.conn = psycopg2.connect(dsn)
+        self.create()
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        with self._lock:
+            try:
+                with self.conn.cursor() as cur:
+                    yield cur
+            except BaseException:
+                self.conn.rollback()
+                raise
+            else:
+                self.conn.commit()
+
+    def _claim(self, cur, n, now):
+        # skip locked: concurrent claims each take different rows
+        cur.execute(
+            "update work set status = 'leased', owner = %s, lease_until = %s, "
+            "attempts = attempts + 1, updated = %s "
+            "where key in ("
+            "  select key from work "
+            "  where (status = 'todo' or (status = 'leased' and lease_until < %s)) "
+            "  and attempts < %s order by cost desc limit %s "
+            "  for update skip locked"
+            ") returning key",
+            (self.node_id, now + self.lease_secs, now, now, self.max_attempts, n),
+        )
+        return [row[0] for row in cur.fetchall()]
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+def open_coordinator(uri, **kwargs):
+    # sqlite:///relative.sqlite, sqlite:////abs/path.sqlite, a bare path,
+    # or postgresql://...
+    parsed = urlparse(uri)
+
+    if parsed.scheme in ('postgres', 'postgresql'):
+        return PostgresCoordinator(uri, **kwargs)
+    elif parsed.scheme == 'sqlite':
+        return SqliteCoordinator(uri[len('sqlite:///'):], **kwargs)
+    elif parsed.scheme == '':
+        return SqliteCoordinator(uri, **kwargs)
+    else:
+        raise ValueError(f'Unsupported coordinator URI {uri}')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('uri', help='sqlite:///path or postgresql://... URI')
+    parser.add_argument('--requeue', action='store_true',
+                        help='put failed keys back in the queue')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    fmt = '%(asctime)s : %(levelname)s : %(message)s'
+    logging.basicConfig(format=fmt, level=logging.INFO)
+
+    args = parse_args()
+
+    coord = open_coordinator(args.uri)
+    try:
+        if args.requeue:
+            logger.info(f'Requeued {coord.requeue()} failed keys')
+
+        for status, n in sorted(coord.counts().items()):
+            print(f'{status:<10} {n:>10}')
+    finally:
+        coord.close()
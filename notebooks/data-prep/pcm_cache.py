@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+# ./pcm_cache.py /scratch/whisper-pcm --max-gb 200
+#
+# A local cache of decoded audio, so rerunning transcription over the same
+# keys (e.g. with another whisper_version or compute_type) skips both the
+# download and the decode. Each (key, sample rate) is one file of raw mono
+# int16 PCM, read back as a read-only memory map, so a section is a view
+# on the file and only the pages it covers are read. The cache holds at
+# most max_bytes, evicting the least recently used files when full;
+# several processes can share one directory. Run as a script, reports the cache's
+# size and trims it to --max-gb.
+
+import os
+import uuid
+import hashlib
+import logging
+import argparse
+
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+
+class PcmCache:
+    def __init__(self, cache_dir, max_bytes=100 * 2**30, evict_to=0.9):
+        super().__init__()
+
+        # evict_to: when full, evict down to this fraction of max_bytes,
+        # so the next eviction is that much writing away
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.evict_to = evict_to
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        # the cache's size as of the last scan, plus what we've put since;
+        # other processes' files only show up at the next scan
+        self._size = None
+
+    def _path(self, key, sr):
+        # keys are S3 paths, so hash them into flat file names
+        name = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, f'{name}-{sr}.pcm')
+
+    def get(self, key, sr=16000):
+        # the key's int16 PCM as a read-only memmap, or None if not cached
+        path = self._path(key, sr)
+
+        try:
+            # the mtime is the LRU clock
+            os.utime(path)
+            if os.path.getsize(path) == 0:
+                return np.zeros(0, dtype=np.int16)
+
+            return np.memmap(path, dtype=np.int16, mode='r')
+        except FileNotFoundError:
+            return None  # never cached, or evicted meanwhile
+
+    def put(self, key, audio, sr=16000):
+        # audio: float32 in [-1, 1) as decoded, which is int16 / 32768, so
+        # the round trip is exact
+        pcm = np.clip(np.round(audio * 32768.0), -32768, 32767).astype(np.int16)
+
+        # scanning the directory is O(files), so only when it may be full
+        if self._size is None or self._size + pcm.nbytes > self.max_bytes:
+            self.evict(int(self.max_bytes * self.evict_to) - pcm.nbytes)
+
+        # written under a unique name and renamed in, so a concurrent
+        # reader sees the whole file or none of it
+        path = self._path(key, sr)
+        tmp_path = os.path.join(self.cache_dir, f'.{uuid.uuid4().hex}.tmp')
+        pcm.tofile(tmp_path)
+        os.replace(tmp_path, path)
+        self._size += pcm.nbytes
+
+    def _entries(self):
+        entries = []
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if not entry.name.endswith('.pcm'):
+                    continue
+
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue  # evicted by another process
+
+                entries += [(stat.st_mtime, stat.st_size, entry.path)]
+
+        return sorted(entries)
+
+    def size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self, max_bytes=None):
+        # drop the least recently used files until at most max_bytes are
+        # left. Memory maps already open on an evicted file stay valid.
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+
+        n = 0
+        for _, size, path in entries:
+            if total <= max_bytes:
+                break
+
+            try:
+                os.remove(path)
+                n += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+
+        self._size = total
+        if n:
+            logger.debug(f'Evicted {n} files from {self.cache_dir}')
+
+        return n
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('cache_dir', help='PCM cache directory')
+    parser.add_argument('--max-gb', default=None, type=float,
+                        help='evict down to this size')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    fmt = '%(asctime)s : %(levelname)s : %(message)s'
+    logging.basicConfig(format=fmt, level=logging.INFO)
+
+    args = parse_args()
+
+    cache = PcmCache(args.cache_dir)
+    if args.max_gb is not None:
+        n = cache.evict(int(args.max_gb * 2**30))
+        logger.info(f'Evicted {n} files')
+
+    entries = cache._entries()
+    print(f'{len(entries)} files, {sum(s for _, s, _ in entries) / 2**30:.2f} GB')
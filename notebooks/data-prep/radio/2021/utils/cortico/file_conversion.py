@@ -2,11 +2,20 @@
 
 """
 Utilities for dealing with audio files.
+
+Conversion, cutting and concatenation run in-process with PyAV when it's
+installed, rather than spawning ffmpeg for every call; the ffmpeg CLI is
+still used without it, or when asked for with backend="ffmpeg".
 """
 
 import logging
 import subprocess
 
+try:
+    import av
+except ImportError:
+    av = None
+
 AVCONF_CMD = "/usr/bin/ffmpeg -i %s -ac 1 %s"
 FILE_CMD = "/usr/bin/file %s"
 
@@ -18,6 +27,125 @@ SUBSEGMENT_CMD = FFMPEG_CMD + " -y -ss %f -i %s -acodec copy -t %f %s"
 # Convert to mp3 and subsegment in one call
 SUBSEGMENT2_CMD = FFMPEG_CMD + " -y -i %s -ac 1 -ss %f -t %f %s"
 
+BACKENDS = ("av", "ffmpeg")
+DEFAULT_BACKEND = "av" if av is not None else "ffmpeg"
+
+
+def _add_copy_stream(container, template):
+    # the API for this changed in PyAV 14
+    if hasattr(container, "add_stream_from_template"):
+        return container.add_stream_from_template(template)
+    return container.add_stream(template=template)
+
+
+def _encode(container, stream, frame):
+    for packet in stream.encode(frame):
+        container.mux(packet)
+
+
+def _av_transcode(in_fnames, out_fname, start_secs=0, duration=None, layout=None):
+    """
+    Decode in_fnames one after another and encode them as one stream in
+    the default codec for out_fname's extension, like ffmpeg does. The
+    sample rate, and the channel layout unless given, are the first
+    input's; start_secs and duration cut the (single) input, to the sample.
+    """
+    end_secs = start_secs + duration if duration is not None else None
+
+    with av.open(out_fname, "w") as dst:
+        stream = None
+
+        for fname in in_fnames:
+            with av.open(fname, metadata_errors="ignore") as src:
+                if stream is None:
+                    in_stream = src.streams.audio[0]
+                    rate = in_stream.rate
+                    layout = layout or in_stream.layout.name
+
+                    stream = dst.add_stream(dst.default_audio_codec, rate=rate)
+                    stream.layout = layout
+
+                # a resampler only takes frames like the first it's given
+                resampler = av.AudioResampler(
+                    format=stream.format, layout=layout, rate=rate
+                )
+
+                if start_secs:
+                    src.seek(int(start_secs * av.time_base))
+
+                for frame in src.decode(audio=0):
+                    for out in resampler.resample(frame):
+                        start = out.time if out.time is not None else 0.0
+                        end = start + out.samples / rate
+
+                        if end <= start_secs:
+                            continue
+                        if end_secs is not None and start >= end_secs:
+                            break
+
+                        if start < start_secs or (end_secs is not None and end > end_secs):
+                            # trim a frame straddling the cut points
+                            lo = max(int(round((start_secs - start) * rate)), 0)
+                            hi = out.samples
+                            if end_secs is not None:
+                                hi = min(int(round((end_secs - start) * rate)), hi)
+
+                            array = out.to_ndarray()
+                            if not out.format.is_planar:
+                                array = array.reshape(-1, len(out.layout.channels))
+                                array = array[lo:hi].reshape(1, -1)
+                            else:
+                                array = array[:, lo:hi]
+
+                            out = av.AudioFrame.from_ndarray(
+                                array, format=out.format.name, layout=out.layout.name
+                            )
+                            out.sample_rate = rate
+
+                        out.pts = None
+                        _encode(dst, stream, out)
+
+                    if end_secs is not None and frame.time is not None and frame.time >= end_secs:
+                        break
+
+                for out in resampler.resample(None):
+                    out.pts = None
+                    _encode(dst, stream, out)
+
+        _encode(dst, stream, None)
+
+
+def _av_copy_segment(fname, out_fname, start_secs, duration):
+    """
+    Copy the packets from start_secs for duration seconds into out_fname
+    without re-encoding, like ffmpeg -ss ... -acodec copy -t ...
+    """
+    with av.open(fname, metadata_errors="ignore") as src, av.open(out_fname, "w") as dst:
+        in_stream = src.streams.audio[0]
+        out_stream = _add_copy_stream(dst, in_stream)
+
+        if start_secs:
+            src.seek(int(start_secs * av.time_base))
+
+        offset = None
+        for packet in src.demux(in_stream):
+            if packet.dts is None or packet.pts is None:
+                continue  # the demuxer's final, empty packet
+
+            t = float(packet.pts * packet.time_base)
+            if t + float((packet.duration or 0) * packet.time_base) <= start_secs:
+                continue
+            if offset is not None and t >= start_secs + duration:
+                break
+
+            # the output's timestamps start at zero
+            if offset is None:
+                offset = packet.pts
+            packet.pts -= offset
+            packet.dts -= offset
+            packet.stream = out_stream
+            dst.mux(packet)
+
 
 def audio_file_type(fname):
     x = subprocess.check_output((FILE_CMD % (fname)).split())
@@ -31,33 +159,54 @@ def audio_file_type(fname):
     return "OTHER"
 
 
-def convert_to_wav(fname):
+def convert_to_wav(fname, backend=DEFAULT_BACKEND):
+    if backend == "av":
+        _av_transcode([fname], fname + ".wav", layout="mono")
+        return fname + ".wav"
+
     x = subprocess.check_output((AVCONF_CMD % (fname, fname + ".wav")).split())
     return fname + ".wav"
 
 
-def convert_to_mp3(fname):
+def convert_to_mp3(fname, backend=DEFAULT_BACKEND):
+    if backend == "av":
+        _av_transcode([fname], fname + ".mp3", layout="mono")
+        return fname + ".mp3"
+
     x = subprocess.check_output((AVCONF_CMD % (fname, fname + ".mp3")).split())
     return fname + ".mp3"
 
 
-def get_audio_subsegment(fname, out_fname, start_secs, end_secs):
+def get_audio_subsegment(fname, out_fname, start_secs, end_secs, backend=DEFAULT_BACKEND):
     duration = end_secs - start_secs
+    if backend == "av":
+        return _av_copy_segment(fname, out_fname, start_secs, duration)
+
     x = subprocess.check_output(
         (SUBSEGMENT_CMD % (start_secs, fname, duration, out_fname)).split()
     )
     return x
 
 
-def get_mp3_subsegment(fname, out_fname, start_secs, end_secs):
+def get_mp3_subsegment(fname, out_fname, start_secs, end_secs, backend=DEFAULT_BACKEND):
     duration = end_secs - start_secs
+    if backend == "av":
+        return _av_transcode([fname], out_fname, start_secs, duration, layout="mono")
+
     x = subprocess.check_output(
         (SUBSEGMENT2_CMD % (fname, start_secs, duration, out_fname)).split()
     )
     return x
 
 
-def concatenate_files(file_list, out_fname):
+def concatenate_files(file_list, out_fname, backend=DEFAULT_BACKEND):
+    if backend == "av":
+        try:
+            _av_transcode(file_list, out_fname)
+        except av.error.FFmpegError:
+            print("Concatenation error", file_list, out_fname)
+        return
+
     # https://superuser.com/questions/587511/concatenate-multiple-wav-files-using-single-command-without-extra-file
     concat_cmd = FFMPEG_CMD + " " + " ".join(["-i %s" % (fname) for fname in file_list])
     concat_cmd += " -filter_complex %sconcat=n=%d:v=0:a=1[out] -map [out] %s" % (
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+
+# ./storage.py s3://cortico-data /data/audio-mirror keys.txt
+#
+# Where the audio lives: the S3 bucket, a local mirror of it laid out the
+# same way (speechbox/stream_out/<date>/<callsign>/<time>.raw under some
+# root directory), or an HTTP server that supports range requests. Run as a
+# script, copies a list of keys from one storage to a local mirror.
+
+import os
+import io
+import shutil
+import logging
+import argparse
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from urllib.parse import urlparse, quote
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import boto3
+import botocore.config
+import urllib3
+
+from tqdm import tqdm
+
+
+logger = logging.getLogger(__name__)
+
+
+class Storage(ABC):
+    @abstractmethod
+    def open(self, key, start=None, end=None):
+        # a readable binary stream of the object's bytes in [start, end)
+        raise NotImplementedError()
+
+    @abstractmethod
+    def url(self, key):
+        # a location ffmpeg can open and seek in by itself
+        raise NotImplementedError()
+
+    @abstractmethod
+    def exists(self, key):
+        raise NotImplementedError()
+
+
+def _range_header(start, end):
+    if start is None and end is None:
+        return None
+
+    return f"bytes={start or 0}-{'' if end is None else end - 1}"
+
+
+class S3Storage(Storage):
+    def __init__(self, bucket, aws_profile=None, max_pool_connections=32,
+                 url_expires=3600):
+        super().__init__()
+
+        self.bucket = bucket
+        self.aws_profile = aws_profile
+        self.url_expires = url_expires
+
+        # boto3 clients are thread-safe; one client and one connection pool
+        # sized for the prefetch and GPU threads serves the whole process
+        self.session = boto3.Session(profile_name=aws_profile)
+        self.client = self.session.client('s3', config=botocore.config.Config(
+            max_pool_connections=max_pool_connections,
+            retries={'max_attempts': 10, 'mode': 'adaptive'},
+            tcp_keepalive=True,
+        ))
+
+    def open(self, key, start=None, end=None):
+        kwargs = {'Bucket': self.bucket, 'Key': key}
+
+        rng = _range_header(start, end)
+        if rng is not None:
+            kwargs['Range'] = rng
+
+        return self.client.get_object(**kwargs)['Body']
+
+    def url(self, key):
+        return self.client.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': self.bucket, 'Key': key},
+            ExpiresIn=self.url_expires,
+        )
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+            return True
+        except self.client.exceptions.ClientError as exc:
+            if exc.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                return False
+            raise
+
+
+class LocalStorage(Storage):
+    def __init__(self, root):
+        super().__init__()
+
+        self.root = os.path.abspath(os.path.expanduser(root))
+
+    def path(self, key):
+        path = os.path.normpath(os.path.join(self.root, key))
+        if os.path.commonpath([self.root, path]) != self.root:
+            raise ValueError(f'Key {key} is outside of {self.root}')
+
+        return path
+
+    def open(self, key, start=None, end=None):
+        f = open(self.path(key), 'rb')
+
+        if start is None and end is None:
+            return f
+
+        # hand back just the requested bytes, like a ranged GET would
+        with f:
+            f.seek(start or 0)
+            return io.BytesIO(f.read() if end is None else f.read(end - (start or 0)))
+
+    def url(self, key):
+        return self.path(key)
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    def put(self, key, fobj):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            shutil.copyfileobj(fobj, f, 1 << 20)
+        os.replace(tmp, path)
+
+
+class HttpStorage(Storage):
+    def __init__(self, base_url, pool_size=32, timeout=60.0, retries=5):
+        super().__init__()
+
+        self.base_url = base_url.rstrip('/') + '/'
+        self.timeout = timeout
+
+        # PoolManager is thread-safe and keeps pool_size connections per host
+        self.http = urllib3.PoolManager(
+            maxsize=pool_size,
+            block=True,
+            retries=urllib3.Retry(total=retries, backoff_factor=0.5,
+                                  status_forcelist=(500, 502, 503, 504)),
+            timeout=urllib3.Timeout(connect=10.0, read=timeout),
+        )
+
+    def url(self, key):
+        return self.base_url + quote(key)
+
+    def open(self, key, start=None, end=None):
+        rng = _range_header(start, end)
+        headers = {'Range': rng} if rng is not None else {}
+
+        resp = self.http.request('GET', self.url(key), headers=headers,
+                                 preload_content=False)
+        if resp.status not in (200, 206):
+            resp.release_conn()
+            raise RuntimeError(f'GET {self.url(key)} returned {resp.status}')
+
+        return resp
+
+    def exists(self, key):
+        resp = self.http.request('HEAD', self.url(key))
+        return resp.status == 200
+
+
+@lru_cache(maxsize=None)
+def get_storage(uri, aws_profile=None):
+    # one instance per process and URI, so every thread shares its pool
+    parsed = urlparse(uri)
+
+    if parsed.scheme == 's3':
+        return S3Storage(parsed.netloc, aws_profile=aws_profile)
+    elif parsed.scheme in ('http', 'https'):
+        return HttpStorage(uri)
+    elif parsed.scheme in ('file', ''):
+        return LocalStorage(parsed.path if parsed.scheme else uri)
+    else:
+        raise ValueError(f'Unsupported storage URI {uri}')
+
+
+def mirror(src, dst, keys, n_threads=16, progress=True):
+    def copy(key):
+        if dst.exists(key):
+            return key
+
+        body = src.open(key)
+        try:
+            dst.put(key, body)
+        finally:
+            body.close()
+
+        return key
+
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        futures = [executor.submit(copy, key) for key in keys]
+
+        for future in tqdm(as_completed(futures), total=len(futures),
+                           desc='Mirror', unit='file', disable=(not progress)):
+            try:
+                future.result()
+            except Exception as exc:
+                logger.exception('Unhandled exception in thread')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('src', help='storage URI to copy from')
+    parser.add_argument('dst', help='local mirror root directory')
+    parser.add_argument('keys', help='file with one audio key per line')
+
+    parser.add_argument('-a', '--aws-profile', default='cortico')
+    parser.add_argument('-j', '--n-threads', default=16, type=int)
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    fmt = '%(asctime)s : %(levelname)s : %(message)s'
+    logging.basicConfig(format=fmt, level=logging.INFO)
+
+    args = parse_args()
+
+    with open(args.keys, 'rt') as f:
+        keys = [line.strip() for line in f if line.strip()]
+
+    mirror(
+        src=get_storage(args.src, aws_profile=args.aws_profile),
+        dst=LocalStorage(args.dst),
+        keys=keys,
+        n_threads=args.n_threads,
+    )
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+
+# ./task_manifest.py auto-sample-whisper-tasks.pkl auto-sample-whisper-tasks.manifest
+#
+# Transcription tasks (each audio key's snippets: id, offset, duration) as
+# flat columns sorted by key, plus each key's start row in them, saved as
+# a directory of .npy files. Loading memory-maps the files, so opening a
+# manifest is instant and looking up a key reads only that key's rows. A
+# TaskManifest is a read-only {key: DataFrame} mapping, and can be passed
+# anywhere a tasks dict is taken. Run as a script, converts a pickled
+# tasks dict from an older prep_tasks() into a manifest.
+
+import os
+import pickle
+import shutil
+import logging
+import argparse
+from collections.abc import Mapping
+
+import numpy as np
+import pandas as pd
+
+
+logger = logging.getLogger(__name__)
+
+
+class TaskManifest(Mapping):
+    columns = ['id', 'offset', 'duration']
+
+    def __init__(self, keys, starts, columns, path=None):
+        super().__init__()
+
+        # keys: sorted, unique; key i's rows are starts[i]:starts[i + 1]
+        self._keys = keys
+        self._starts = starts
+        self._columns = columns
+        self.path = path
+
+    @classmethod
+    def _from_rows(cls, row_keys, columns):
+        # rows must already be grouped by key, in sorted key order
+        keys, starts = np.unique(row_keys, return_index=True)
+        starts = np.append(starts, len(row_keys)).astype(np.int64)
+
+        return cls(keys, starts, columns)
+
+    @classmethod
+    def from_frame(cls, df, key='key'):
+        # a snippet table with key, id, offset and duration columns; the
+        # rows keep their order within each key
+        df = df.sort_values(key, kind='stable')
+
+        columns = {}
+        for c in cls.columns:
+            values = df[c].to_numpy()
+            if values.dtype == object:
+                values = values.astype(str)  # object arrays can't be mapped
+            columns[c] = values
+
+        return cls._from_rows(df[key].to_numpy().astype(str), columns)
+
+    @classmethod
+    def from_dict(cls, tasks):
+        # {key: DataFrame}, as prep_tasks() used to return
+        frames = [v[cls.columns].assign(key=k) for k, v in tasks.items()]
+        if not frames:
+            return cls.from_frame(pd.DataFrame(columns=['key'] + cls.columns))
+
+        return cls.from_frame(pd.concat(frames, ignore_index=True))
+
+    def save(self, path):
+        # written next to the target and renamed in, so a manifest
+        # appears complete or not at all
+        tmp_path = path.rstrip('/') + '.tmp'
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+
+        np.save(os.path.join(tmp_path, 'keys.npy'), self._keys)
+        np.save(os.path.join(tmp_path, 'starts.npy'), self._starts)
+        for c, values in self._columns.items():
+            np.save(os.path.join(tmp_path, f'{c}.npy'), values)
+
+        # a directory can't be renamed over a non-empty one
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+        self.path = path
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        mode = 'r' if mmap else None
+
+        return cls(
+            keys=np.load(os.path.join(path, 'keys.npy'), mmap_mode=mode),
+            starts=np.load(os.path.join(path, 'starts.npy'), mmap_mode=mode),
+            columns={
+                c: np.load(os.path.join(path, f'{c}.npy'), mmap_mode=mode)
+                for c in cls.columns
+            },
+            path=path,
+        )
+
+    @staticmethod
+    def exists(path):
+        return os.path.exists(os.path.join(path, 'starts.npy'))
+
+    def __getstate__(self):
+        # a saved manifest pickles as its path and is re-mapped on the
+        # other side, rather than copying the arrays
+        if self.path is not None and isinstance(self._starts, np.memmap):
+            return {'path': self.path}
+
+        return self.__dict__
+
+    def __setstate__(self, state):
+        if set(state) == {'path'}:
+            state = self.load(state['path']).__dict__
+
+        self.__dict__.update(state)
+
+    def _index(self, key):
+        i = int(np.searchsorted(self._keys, key))
+        if i == len(self._keys) or self._keys[i] != key:
+            raise KeyError(key)
+
+        return i
+
+    def __getitem__(self, key):
+        i = self._index(key)
+        start, end = int(self._starts[i]), int(self._starts[i + 1])
+
+        return pd.DataFrame({
+            c: np.asarray(self._columns[c][start:end])
+            for c in self.columns
+        })
+
+    def __contains__(self, key):
+        try:
+            self._index(key)
+        except KeyError:
+            return False
+
+        return True
+
+    def __iter__(self):
+        return (str(k) for k in self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    @property
+    def n_sections(self):
+        return int(self._starts[-1])
+
+    def _row_keys(self):
+        return np.repeat(np.asarray(self._keys), np.diff(self._starts))
+
+    def durations(self):
+        # {key: total section duration}, without building any DataFrames
+        totals = np.add.reduceat(np.asarray(self._columns['duration'], dtype=float),
+                                 self._starts[:-1]) if len(self) else []
+
+        return dict(zip(self, map(float, totals)))
+
+    def to_frame(self):
+        # every row, with a key column
+        return pd.DataFrame(dict(
+            key=self._row_keys(),
+            **{c: np.asarray(self._columns[c]) for c in self.columns}
+        ))
+
+    def select(self, mask):
+        # a new, in-memory manifest of the rows where mask is true
+        mask = np.asarray(mask, dtype=bool)
+        return self._from_rows(
+            self._row_keys()[mask],
+            {c: np.asarray(v)[mask] for c, v in self._columns.items()},
+        )
+
+    def subset(self, keys):
+        return self.select(np.isin(self._row_keys(), np.asarray(list(keys), dtype=str)))
+
+
+def load_tasks(path):
+    # a manifest directory, or a pickled tasks dict from before them
+    if TaskManifest.exists(path):
+        return TaskManifest.load(path)
+
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('src', help='pickled {key: DataFrame} tasks dict')
+    parser.add_argument('dst', help='manifest directory to write')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    fmt = '%(asctime)s : %(levelname)s : %(message)s'
+    logging.basicConfig(format=fmt, level=logging.INFO)
+
+    args = parse_args()
+
+    with open(args.src, 'rb') as f:
+        manifest = TaskManifest.from_dict(pickle.load(f))
+
+    manifest.save(args.dst)
+    logger.info(f'Wrote {len(manifest)} keys, {manifest.n_sections} sections '
+                f'to {args.dst}')
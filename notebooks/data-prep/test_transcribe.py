@@ -0,0 +1,56 @@
+import collections
+
+import numpy as np
+
+import transcribe as tr
+
+
+Word = collections.namedtuple('Word', 'start end word probability')
+Segment = collections.namedtuple(
+    'Segment', 'start end text avg_logprob no_speech_prob words'
+)
+Info = collections.namedtuple('Info', 'language language_probability duration')
+
+
+class PackingPipeline:
+    # Like BatchedInferencePipeline: consecutive clips are packed into
+    # windows of up to chunk_length seconds, and each window comes back as
+    # one segment, here with a word every 0.7s across all of it
+    def transcribe(self, audio, batch_size, clip_timestamps, vad_filter,
+                   word_timestamps, sr=16000, chunk_length=30):
+        windows = []
+        for clip in clip_timestamps:
+            if windows and clip['end'] - windows[-1][0] <= chunk_length * sr:
+                windows[-1][1] = clip['end']
+            else:
+                windows += [[clip['start'], clip['end']]]
+
+        segs = []
+        for start, end in windows:
+            start, end = start / sr, end / sr
+            words = [
+                Word(t, t + 0.6, ' w', 0.9)
+                for t in np.arange(start - 0.2, end, 0.7)
+            ]
+            segs += [Segment(words[0].start, words[-1].end,
+                             ''.join(w.word for w in words), -0.2, 0.01, words)]
+
+        info = Info('en', 0.99, audio.shape[0] / sr)
+        return iter(segs), info
+
+
+def test_batch_word_times_stay_in_sections():
+    sr = 16000
+    durations = [4.3, 1.1, 12.0, 0.5, 41.7, 7.9]
+    audios = [np.zeros(int(d * sr), dtype=np.float32) for d in durations]
+
+    segs, infos = tr.transcribe_audio_batch(PackingPipeline(), audios, sr=sr)
+
+    assert len(segs) == len(infos) == len(durations)
+    for section, duration in zip(segs, durations):
+        assert section, 'every section gets its own words'
+
+        for seg in section:
+            assert 0 <= seg['start'] <= seg['end'] <= duration
+            for word in seg['words']:
+                assert 0 <= word['start'] <= word['end'] <= duration
@@ -1,4 +1,4 @@
-from typing import Dict, Any, Union, Optional
+from typing import Dict, Any, Union, Optional, Mapping
 
 import os
 import io
@@ -13,11 +13,17 @@ import pickle
 import hashlib
 import logging
 import argparse
+import contextlib
+import threading
 import subprocess
+import collections
+import queue as queue_mod
 import multiprocessing as mp
-from abc import ABC, abstractmethod
-from functools import cached_property
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from abc import ABC
+from functools import cached_property, partial
+from concurrent.futures import (
+    ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+)
 
 import numpy as np
 import pandas as pd
@@ -26,15 +32,30 @@ import boto3
 import botocore
 
 import ffmpeg
-from faster_whisper import WhisperModel
+from faster_whisper import WhisperModel, BatchedInferencePipeline
+from faster_whisper.vad import VadOptions, get_speech_timestamps
 
 import torch
 
 from IPython.display import Audio
 
+# in-process decoding; faster-whisper depends on PyAV, so it's normally
+# here, but the ffmpeg CLI still works without it
+try:
+    import av
+except ImportError:
+    av = None
+
 # will switch automatically to the console version when on console
 from tqdm import tqdm
 
+from storage import get_storage
+from transcript_cache import open_cache
+from transcribe_timing import TimingLog
+from coordinator import open_coordinator
+from task_manifest import TaskManifest
+from pcm_cache import PcmCache
+
 
 logger = logging.getLogger(__name__)
 
@@ -94,17 +115,76 @@ def play_s3_audio(bucket: str, key: str, start_time: float,
 # Loading audio
 #
 
-def _load_audio_fobj(audio, sr: int = 16000, start_time: Union[float, int] = 0,
-                     end_time: Optional[Union[float, int]] = None):
+# 'av' decodes and resamples in-process with PyAV (the libraries ffmpeg
+# is built on), 'ffmpeg' spawns the ffmpeg CLI for every decode; both
+# produce the same 16-bit mono PCM
+AUDIO_BACKENDS = {'av', 'ffmpeg'}
+DEFAULT_AUDIO_BACKEND = 'av' if av is not None else 'ffmpeg'
+
+def _pcm_to_float(out):
+    return np.frombuffer(out, np.int16).flatten().astype(np.float32) / 32768.0
+
+def _av_frames(frames):
+    # skips frames that fail to decode, like ffmpeg's -err_detect ignore_err
+    frames = iter(frames)
+    while True:
+        try:
+            yield next(frames)
+        except StopIteration:
+            return
+        except av.error.InvalidDataError:
+            continue
+
+def _av_decode(source, sr: int = 16000, start_time: Union[float, int] = 0,
+               end_time: Optional[Union[float, int]] = None):
+    # source: a path, URL or readable file object. A start_time seeks to
+    # the keyframe before it and decodes forward, as ffmpeg's input-side
+    # -ss does, so only about the requested range is read and decoded
+    resampler = av.audio.resampler.AudioResampler(format='s16', layout='mono', rate=sr)
+
+    chunks, first = [], None
     try:
+        with av.open(source, mode='r', metadata_errors='ignore') as container:
+            # times count from the container's start time, as in ffmpeg
+            origin = (container.start_time or 0) / av.time_base
+            if start_time:
+                container.seek(int((start_time + origin) * av.time_base))
+
+            for frame in _av_frames(container.decode(audio=0)):
+                t = frame.time - origin if frame.time is not None else None
+                if t is not None:
+                    if end_time is not None and t >= end_time:
+                        break
+                    if t + frame.samples / frame.sample_rate <= start_time:
+                        continue
+
+                if first is None:
+                    first = t if t is not None else 0.0
+
+                chunks += [f.to_ndarray().reshape(-1) for f in resampler.resample(frame)]
+            chunks += [f.to_ndarray().reshape(-1) for f in resampler.resample(None)]
+    except av.error.FFmpegError as e:
+        raise RuntimeError(f"Failed to load audio: {e}") from e
+
+    pcm = np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.int16)
+    ret = pcm.astype(np.float32) / 32768.0
+
+    # the decode starts at a keyframe, usually a little before start_time
+    first = first or 0.0
+    return _slice_audio(ret, sr=sr, start_time=max(start_time - first, 0),
+                        end_time=(end_time - first) if end_time else None)
+
+def _load_audio_fobj(audio, sr: int = 16000, start_time: Union[float, int] = 0,
+                     end_time: Optional[Union[float, int]] = None,
+                     backend: str = DEFAULT_AUDIO_BACKEND):
+    if backend == 'av':
         audio.seek(0, 0)
+        return _slice_audio(_av_decode(audio, sr=sr), sr=sr,
+                            start_time=start_time, end_time=end_time)
 
-        input_data = b''
-        while True:
-            chunk = audio.read(4096)
-            if not chunk:
-                break
-            input_data += chunk
+    try:
+        audio.seek(0, 0)
+        input_data = audio.read()
 
         out, _ = (
             ffmpeg.input(
@@ -126,10 +206,118 @@ def _load_audio_fobj(audio, sr: int = 16000, start_time: Union[float, int] = 0,
     except ffmpeg.Error as e:
         raise RuntimeError(f"Failed to load audio: {e.stderr.decode()}") from e
 
-    ret = np.frombuffer(out, np.int16).flatten().astype(np.float32) / 32768.0
+    ret = _pcm_to_float(out)
+
+    return _slice_audio(ret, sr=sr, start_time=start_time, end_time=end_time)
+
+class _TimedReader:
+    # wraps a byte stream, counting the seconds spent blocked in read()
+    def __init__(self, stream):
+        self.stream = stream
+        self.read_time = 0.0
+
+    def read(self, size=-1):
+        t0 = time.perf_counter()
+        try:
+            return self.stream.read(size)
+        finally:
+            self.read_time += time.perf_counter() - t0
+
+def _load_audio_stream(stream, sr: int = 16000, chunk_size: int = 1 << 16,
+                       backend: str = DEFAULT_AUDIO_BACKEND):
+    # Decode an unseekable byte stream (e.g. an S3 StreamingBody) as it's
+    # read, so the encoded file is never buffered in memory on our side:
+    # PyAV pulls from it directly; ffmpeg is fed on its stdin from a thread
+    # while we read PCM off its stdout
+    if backend == 'av':
+        return _av_decode(stream, sr=sr)
+
+    proc = (
+        ffmpeg.input('pipe:', threads=0, err_detect='ignore_err')
+        .output("-", format="s16le", acodec="pcm_s16le", ac=1, ar=sr)
+        .run_async(
+            cmd=["ffmpeg", "-nostdin"],
+            pipe_stdin=True,
+            pipe_stdout=True,
+            pipe_stderr=True,
+        )
+    )
+
+    def feed():
+        try:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                proc.stdin.write(chunk)
+        except (BrokenPipeError, ValueError):
+            pass  # ffmpeg exited early; its return code tells us why
+        finally:
+            try:
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass
+
+    err = []
+    threads = [
+        threading.Thread(target=feed, daemon=True),
+        threading.Thread(target=lambda: err.append(proc.stderr.read()),
+                         daemon=True),
+    ]
+    for thread in threads:
+        thread.start()
+
+    out = proc.stdout.read()
+    proc.wait()
+    for thread in threads:
+        thread.join()
+
+    if proc.returncode != 0:
+        raise RuntimeError(f"Failed to load audio: {b''.join(err).decode()}")
 
-    ss, es = int(sr*start_time), int(sr*(end_time if end_time else ret.shape[0]))
-    return ret[ss:es]
+    return _pcm_to_float(out)
+
+def _load_audio_range(source: str, sr: int = 16000,
+                      start_time: Union[float, int] = 0,
+                      end_time: Optional[Union[float, int]] = None,
+                      backend: str = DEFAULT_AUDIO_BACKEND):
+    # source must be seekable by ffmpeg itself (a path or an http(s) URL),
+    # so input-side -ss/-to only read and decode the requested range
+    if backend == 'av':
+        return _av_decode(source, sr=sr, start_time=start_time, end_time=end_time)
+
+    try:
+        out, _ = (
+            ffmpeg.input(
+                source,
+                threads=0,
+                ss=start_time,
+                err_detect='ignore_err',
+                **({"to": end_time} if end_time else {})
+            )
+            .output("-", format="s16le", acodec="pcm_s16le", ac=1, ar=sr)
+            .run(
+                cmd=["ffmpeg", "-nostdin"],
+                capture_stdout=True,
+                capture_stderr=True
+            )
+        )
+    except ffmpeg.Error as e:
+        raise RuntimeError(f"Failed to load audio: {e.stderr.decode()}") from e
+
+    return _pcm_to_float(out)
+
+def _slice_audio(audio, sr: int = 16000, start_time: Union[float, int] = 0,
+                 end_time: Optional[Union[float, int]] = None):
+    # basic slicing, so this is a view on the decoded buffer, not a copy
+    ss, es = int(sr*start_time), int(sr*(end_time if end_time else audio.shape[0]))
+    return audio[ss:es]
+
+def _as_float(audio):
+    # int16 PCM (from the PCM cache) to float32; a copy of just this slice
+    if audio.dtype == np.int16:
+        return audio.astype(np.float32) / 32768.0
+    return audio
 
 def _load_audio(audio, **kwargs: Any):
     if not isinstance(audio, str):
@@ -149,7 +337,11 @@ def segment_to_json(segment):
 
     ret = {}
     for field in segment_fields:
-        ret[field] = getattr(segment, field)
+        if field == 'avg_log_prob' and not hasattr(segment, field):
+            # faster-whisper's name for it; the JSON keeps ours
+            ret[field] = getattr(segment, 'avg_logprob')
+        else:
+            ret[field] = getattr(segment, field)
 
     ret['words'] = []
     for word in getattr(segment, 'words'):
@@ -163,41 +355,570 @@ def whisper_to_json(segments, info):
     return dict(info, segments=segments)
 
 
+def shift_segment_json(segment, delta):
+    ret = dict(segment, start=segment['start'] + delta, end=segment['end'] + delta)
+    ret['words'] = [
+        dict(w, start=w['start'] + delta, end=w['end'] + delta)
+        for w in segment['words']
+    ]
+
+    return ret
+
+
+def split_segments_json(segments, bounds):
+    # Splits segments transcribed over one span of audio into a list per
+    # (start, end) section of that span, by word midpoint, with times
+    # relative to each section's start. A word in two overlapping sections
+    # goes to both; a segment without words goes by its own midpoint.
+    ret = [[] for _ in bounds]
+
+    for seg in segments:
+        for j, (start, end) in enumerate(bounds):
+            if not seg['words']:
+                if start <= (seg['start'] + seg['end']) / 2 < end:
+                    piece = dict(seg, start=max(seg['start'], start),
+                                 end=min(seg['end'], end))
+                    ret[j] += [shift_segment_json(piece, -start)]
+                continue
+
+            words = [
+                dict(w, start=max(w['start'], start), end=min(w['end'], end))
+                for w in seg['words']
+                if start <= (w['start'] + w['end']) / 2 < end
+            ]
+            if not words:
+                continue
+
+            piece = dict(
+                seg,
+                start=words[0]['start'],
+                end=words[-1]['end'],
+                text=''.join(w['word'] for w in words),
+                words=words,
+            )
+            ret[j] += [shift_segment_json(piece, -start)]
+
+    return ret
+
+
+#
+# Voice activity detection: find the speech in a section so the rest
+# (music beds, ads, dead air) can be cut out before ASR
+#
+
+def energy_speech_spans(audio, sr=16000, frame_secs=0.03, threshold_db=-40.0,
+                        min_speech_secs=0.25, min_silence_secs=1.0,
+                        pad_secs=0.2):
+    # Frames louder than threshold_db (dBFS RMS) count as speech; gaps
+    # shorter than min_silence_secs are bridged and bursts shorter than
+    # min_speech_secs dropped. Cheap, but it only catches quiet stretches:
+    # music and ads are as loud as talk, for those use 'silero'.
+    frame = int(sr * frame_secs)
+    n_frames = audio.shape[0] // frame
+    if n_frames == 0:
+        return []
+
+    frames = audio[:(n_frames * frame)].reshape(n_frames, frame)
+    rms = np.sqrt(np.mean(np.square(frames, dtype=np.float64), axis=1))
+    loud = 20 * np.log10(np.maximum(rms, 1e-10)) > threshold_db
+
+    # run boundaries, in frames, of the loud stretches
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], loud.astype(np.int8), [0]])))
+    runs = edges.reshape(-1, 2).tolist()
+
+    merged = []
+    for start, end in runs:
+        if merged and (start - merged[-1][1]) * frame_secs < min_silence_secs:
+            merged[-1][1] = end
+        else:
+            merged += [[start, end]]
+
+    pad = int(sr * pad_secs)
+    spans = []
+    for start, end in merged:
+        if (end - start) * frame_secs < min_speech_secs:
+            continue
+
+        start, end = max(start * frame - pad, 0), min(end * frame + pad, audio.shape[0])
+        if spans and start <= spans[-1][1]:
+            spans[-1] = (spans[-1][0], end)
+        else:
+            spans += [(start, end)]
+
+    return spans
+
+def silero_speech_spans(audio, sr=16000, **vad_options):
+    # faster-whisper's bundled Silero model; small enough to run on CPU
+    # alongside decoding, and it tells talk from music
+    return [
+        (ts['start'], ts['end'])
+        for ts in get_speech_timestamps(audio, VadOptions(**vad_options),
+                                        sampling_rate=sr)
+    ]
+
+VAD_METHODS = {
+    'energy': energy_speech_spans,
+    'silero': silero_speech_spans,
+}
+
+def vad_trim(audio, spans):
+    # The speech spans laid end to end, and for each span its start in the
+    # trimmed audio and in the original one (in samples), for remapping
+    if not spans:
+        return audio[:0], np.zeros((0, 2), dtype=np.int64)
+    if len(spans) == 1 and spans[0] == (0, audio.shape[0]):
+        return audio, np.zeros((1, 2), dtype=np.int64)
+
+    lengths = [end - start for start, end in spans]
+    vad_map = np.stack([
+        np.cumsum([0] + lengths[:-1]),
+        [start for start, _ in spans],
+    ], axis=1)
+
+    return np.concatenate([audio[start:end] for start, end in spans]), vad_map
+
+def remap_segment_json(segment, vad_map, sr=16000):
+    # from the trimmed audio's timeline back to the section's; a time on a
+    # cut maps to the end of the span before it if it's an end time
+    trimmed, original = vad_map[:, 0] / sr, vad_map[:, 1] / sr
+
+    def remap(t, side):
+        i = max(np.searchsorted(trimmed, t, side) - 1, 0)
+        return float(t - trimmed[i] + original[i])
+
+    ret = dict(segment, start=remap(segment['start'], 'right'),
+               end=remap(segment['end'], 'left'))
+    ret['words'] = [
+        dict(w, start=remap(w['start'], 'right'), end=remap(w['end'], 'left'))
+        for w in segment['words']
+    ]
+
+    return ret
+
+def vad_speech_secs(vad_map, trimmed_secs, start, end, sr=16000):
+    # seconds of [start, end), on the original timeline, that were kept
+    lengths = np.diff(np.append(vad_map[:, 0] / sr, trimmed_secs))
+    original = vad_map[:, 1] / sr
+
+    overlap = np.minimum(original + lengths, end) - np.maximum(original, start)
+    return float(np.clip(overlap, 0, None).sum())
+
+
+#
+# Running ASR, one snippet at a time or batched across snippets
+#
+
+def transcribe_audio(model, audio):
+    segs, info = model.transcribe(audio, word_timestamps=True)
+    segs = list(segs)  # it's a generator; ASR happens here
+
+    return [segment_to_json(seg) for seg in segs], info._asdict()
+
+
+def transcribe_audio_batch(batched_model, audios, batch_size=16,
+                           sr=16000, chunk_length=30):
+    # The sections are laid end to end in one buffer and passed to the
+    # batched pipeline as clips of at most chunk_length seconds, so the
+    # encoder and decoder see batch_size windows per pass. The pipeline
+    # packs consecutive clips into windows of up to chunk_length seconds,
+    # so short sections share a window, and one segment can run across
+    # sections. Segments come back on the buffer's timeline and are split
+    # among the sections by word midpoint, clamped to their bounds. The
+    # language is detected once for the whole call.
+    offsets = np.cumsum([0] + [a.shape[0] for a in audios])
+    chunk = chunk_length * sr
+
+    clips = [
+        {'start': int(o + s), 'end': int(min(o + s + chunk, o + a.shape[0]))}
+        for a, o in zip(audios, offsets)
+        for s in range(0, a.shape[0], chunk)
+    ]
+
+    ret = [[] for _ in audios]
+    if not clips:
+        return ret, [None] * len(audios)
+
+    segs, info = batched_model.transcribe(
+        np.concatenate(audios),
+        batch_size=batch_size,
+        clip_timestamps=clips,
+        vad_filter=False,
+        word_timestamps=True,
+    )
+
+    bounds = list(zip(offsets[:-1] / sr, offsets[1:] / sr))
+    ret = split_segments_json([segment_to_json(seg) for seg in segs], bounds)
+
+    info = info._asdict()
+    infos = [
+        dict(info, duration=a.shape[0] / sr, duration_after_vad=a.shape[0] / sr)
+        for a in audios
+    ]
+
+    return ret, infos
+
+
 #
 # One S3 audio file; encapsulates processing all associated
 # snippets at once
 #
 
 class FileTask:
-    def __init__(self, bucket, key, sections, client):
+    def __init__(self, storage, key, sections, sr=16000,
+                 decode_once=True, range_decode=True, max_coverage=0.3,
+                 range_overhead=10.0, merge_gap=5.0,
+                 audio_backend=DEFAULT_AUDIO_BACKEND, pcm_cache=None):
         super().__init__()
 
-        self.bucket = bucket
+        # sections: the key's DataFrame, or a whole TaskManifest
+        if isinstance(sections, TaskManifest):
+            sections = sections[key]
+
+        self.storage = storage
         self.key = key
         self.sections = sections
-        self.client = client
+        self.sr = sr
+        self.decode_once = decode_once
+
+        # range decoding: used if the merged section ranges, counting
+        # range_overhead seconds for each extra ffmpeg seek/startup, cover
+        # less than max_coverage of the audio up to the last section's end.
+        # That end stands in for the file's duration, which would take a
+        # probe (a round trip, and a process with ffmpeg) per key to get
+        self.range_decode = range_decode
+        self.max_coverage = max_coverage
+        self.range_overhead = range_overhead
+        self.merge_gap = merge_gap
+        self.audio_backend = audio_backend
+
+        # pcm_cache: None, or a PcmCache to serve the key from, skipping
+        # the fetch and decode, and to add it to on a full decode
+        self.pcm_cache = pcm_cache
+
+        self.decode_mode = None
+        self.fetch_time = None
+        self.decode_time = None
+        self.decode_time_saved = None
+        self.decoded_bytes = None
 
     def _fetch(self):
-        resp = self.client.get_object(
-            Bucket=self.bucket,
-            Key=self.key,
-        )
+        return contextlib.closing(self.storage.open(self.key))
 
-        return io.BytesIO(resp['Body'].read())
+    def _url(self):
+        return self.storage.url(self.key)
 
     def __len__(self):
         return self.sections.shape[0]
 
+    def _bounds(self):
+        starts = self.sections['offset'].to_numpy()
+        return starts, starts + self.sections['duration'].to_numpy()
+
+    def _ranges(self):
+        starts, ends = self._bounds()
+        if not self.decode_once:
+            return list(zip(starts, ends))
+
+        ranges = []
+        for start, end in sorted(zip(starts, ends)):
+            if ranges and start - ranges[-1][1] <= self.merge_gap:
+                ranges[-1][1] = max(ranges[-1][1], end)
+            else:
+                ranges += [[start, end]]
+
+        return [tuple(r) for r in ranges]
+
+    def _plan(self):
+        ranges = self._ranges()
+
+        # with a PCM cache, the whole file, so later runs can use it
+        if self.pcm_cache is not None:
+            return 'full', [(0, None)], None
+        if not self.decode_once:
+            return 'sections', ranges, None
+        if not self.range_decode:
+            return 'full', [(0, None)], None
+
+        # the file is at least this long, so ranges that are sparse on it
+        # are sparser still on the whole file
+        end = max((e for _, e in ranges), default=0)
+        covered = sum(e - s for s, e in ranges) + self.range_overhead * len(ranges)
+        if end <= 0 or covered / end >= self.max_coverage:
+            return 'full', [(0, None)], None
+
+        return 'ranges', ranges, end
+
+    def _decode(self):
+        t0 = time.perf_counter()
+
+        # fetch_time is the part of decode_time spent on storage: opening
+        # and (streamed) reading. With range decoding ffmpeg does its own
+        # reads, which can't be told apart from decoding
+        cached = None
+        if self.pcm_cache is not None:
+            cached = self.pcm_cache.get(self.key, self.sr)
+
+        if cached is not None:
+            self.decode_mode, duration = 'pcm_cache', None
+        else:
+            self.decode_mode, ranges, duration = self._plan()
+        self.fetch_time = time.perf_counter() - t0
+
+        if cached is not None:
+            spans = [(0, cached)]
+        elif self.decode_mode == 'full':
+            t1 = time.perf_counter()
+            with self._fetch() as body:
+                self.fetch_time += time.perf_counter() - t1
+
+                body = _TimedReader(body)
+                spans = [(0, _load_audio_stream(body, sr=self.sr,
+                                                backend=self.audio_backend))]
+            self.fetch_time += body.read_time
+        else:
+            url = self._url()
+            spans = [
+                (s, _load_audio_range(url, sr=self.sr, start_time=s, end_time=e,
+                                      backend=self.audio_backend))
+                for s, e in ranges
+            ]
+
+        if self.pcm_cache is not None and self.decode_mode == 'full':
+            self.pcm_cache.put(self.key, spans[0][1], sr=self.sr)
+
+        self.decode_time = time.perf_counter() - t0
+        if self.decode_mode == 'pcm_cache':
+            # only the sections' float copies are held in memory
+            self.decoded_bytes = int(self.sections['duration'].sum() * self.sr) * 4
+        else:
+            self.decoded_bytes = sum(pcm.nbytes for _, pcm in spans)
+
+        # baseline: every section reran a full decode of the file
+        decoded = sum(pcm.shape[0] for _, pcm in spans) / self.sr
+        full_time = self.decode_time
+        if self.decode_mode == 'ranges' and decoded > 0:
+            full_time *= duration / decoded  # at least; duration is a bound
+        if self.decode_mode == 'sections':
+            self.decode_time_saved = 0
+        else:
+            self.decode_time_saved = max(full_time * len(self) - self.decode_time, 0)
+
+        logger.debug(f'{self.key}: {self.decode_mode} decode of '
+                     f'{decoded:.1f}s of audio for {len(self)} sections in '
+                     f'{self.decode_time:.2f}s, saved ~'
+                     f'{self.decode_time_saved:.2f}s')
+
+        return spans
+
     def __iter__(self):
-        with self._fetch() as _audio:
-            for section in self.sections.itertuples():
-                start = getattr(section, 'offset')
-                end = start + getattr(section, 'duration')
+        spans = self._decode()
+        span_starts = np.array([s for s, _ in spans])
+
+        for i, section in enumerate(self.sections.itertuples()):
+            start = getattr(section, 'offset')
+            end = start + getattr(section, 'duration')
+
+            if self.decode_mode == 'sections':
+                span_start, pcm = spans[i]
+            else:
+                span_start, pcm = spans[np.searchsorted(span_starts, start, 'right') - 1]
+
+            yield {
+                'id': getattr(section, 'id'),
+                'audio': _as_float(_slice_audio(pcm, sr=self.sr,
+                                                start_time=start - span_start,
+                                                end_time=end - span_start)),
+            }
+
+    def _groups(self, max_gap, max_length):
+        # runs of sections, by offset, at most max_gap apart and together
+        # spanning at most max_length seconds (a single longer section is
+        # a group by itself)
+        starts, ends = self._bounds()
+
+        groups = []
+        for i in np.argsort(starts, kind='stable'):
+            if (
+                groups and
+                starts[i] - groups[-1][2] <= max_gap and
+                max(ends[i], groups[-1][2]) - groups[-1][1] <= max_length
+            ):
+                groups[-1][0].append(i)
+                groups[-1][2] = max(groups[-1][2], ends[i])
+            else:
+                groups += [[[i], starts[i], ends[i]]]
+
+        return groups
+
+    def iter_coalesced(self, max_gap=1.0, max_length=300.0):
+        # Like iterating, but yields one item per group of nearby sections:
+        # the audio of the whole span they cover, and each section's id
+        # and (start, end) within it. Sections must be decoded together,
+        # and merge_gap >= max_gap, so a span never straddles two ranges.
+        if not self.decode_once or self.merge_gap < max_gap:
+            raise ValueError('Coalescing needs decode_once and merge_gap >= max_gap')
+
+        spans = self._decode()
+        span_starts = np.array([s for s, _ in spans])
+        ids = self.sections['id'].tolist()
+        starts, ends = self._bounds()
+
+        for inds, start, end in self._groups(max_gap, max_length):
+            span_start, pcm = spans[np.searchsorted(span_starts, start, 'right') - 1]
+
+            yield {
+                'id': ids[inds[0]],
+                'sections': [
+                    (ids[i], float(starts[i] - start), float(ends[i] - start))
+                    for i in inds
+                ],
+                'audio': _as_float(_slice_audio(pcm, sr=self.sr,
+                                                start_time=start - span_start,
+                                                end_time=end - span_start)),
+            }
+
+
+#
+# Prefetching: decode upcoming keys on I/O threads while the model works
+#
+
+class Prefetcher:
+    def __init__(self, load, keys, estimate, n_threads=2, depth=2,
+                 max_bytes=256 * 2**20):
+        super().__init__()
+
+        self.load = load
+        self.keys = keys
+        self.estimate = estimate
+        self.n_threads = n_threads
+        self.depth = depth
+        self.max_bytes = max_bytes
+
+        # bytes of keys handed to the consumer and not yet released
+        self._in_use = {}
+        self._cond = threading.Condition()
+
+    def release(self, key):
+        # the consumer is done with key's audio; its bytes are free again
+        with self._cond:
+            self._in_use.pop(key, None)
+            self._cond.notify_all()
+
+    @staticmethod
+    def _nbytes(est, future):
+        if future.done() and future.exception() is None:
+            return future.result()['nbytes']
+        return est
+
+    def __iter__(self):
+        # (key, loaded) pairs are yielded in key order, with the exception
+        # instead of loaded if that failed. At most depth keys are decoded
+        # ahead of the consumer, and no new key is started while the
+        # decoded (or, if still running, estimated) size of those plus
+        # that of the keys yielded but not yet release()d would exceed
+        # max_bytes; with nothing pending or in use, one key is always
+        # let through so a file bigger than the cap can't stall the
+        # pipeline.
+        #
+        # Keys are pulled on a thread of their own, since pulling one may
+        # block (e.g. on a work queue) and mustn't hold up keys that are
+        # already loaded. When there's nothing pending and that thread is
+        # waiting for a key, or for room, (None, None) is yielded once, so
+        # a consumer holding back a partial batch knows not to wait for
+        # more, and releases what it holds.
+        pending = collections.deque()
+        cond = self._cond
+        state = {'done': False, 'waiting': False, 'stop': False}
+
+        def has_room(est):
+            if not pending and not self._in_use:
+                return True
+            used = sum(self._nbytes(e, f) for _, e, f in pending)
+            used += sum(self._in_use.values())
+            return len(pending) < self.depth and used + est <= self.max_bytes
+
+        def produce(executor):
+            try:
+                keys = iter(self.keys)
+                while True:
+                    with cond:
+                        state['waiting'] = True
+                        cond.notify_all()
+                    key = next(keys, None)
+                    with cond:
+                        state['waiting'] = False
+                    if key is None:
+                        return
 
-                yield {
-                    'id': getattr(section, 'id'),
-                    'audio': _load_audio(_audio, start_time=start, end_time=end)
-                }
+                    try:
+                        est = self.estimate(key)
+                    except Exception:
+                        est = 0  # the load will fail too, and say why
+
+                    with cond:
+                        # finished loads can free up room, so check again
+                        # every so often as well as when notified
+                        while not (state['stop'] or has_room(est)):
+                            if not state['waiting']:
+                                state['waiting'] = True
+                                cond.notify_all()
+                            cond.wait(0.1)
+                        state['waiting'] = False
+                        if state['stop']:
+                            return
+
+                        pending.append((key, est, executor.submit(self.load, key)))
+                        cond.notify_all()
+            except Exception as exc:
+                logger.exception('Unhandled exception reading keys')
+            finally:
+                with cond:
+                    state['done'] = True
+                    cond.notify_all()
+
+        with ThreadPoolExecutor(max_workers=self.n_threads) as executor:
+            producer = threading.Thread(target=produce, args=(executor,), daemon=True)
+            producer.start()
+
+            try:
+                idle = False
+                while True:
+                    with cond:
+                        cond.wait_for(lambda: (
+                            pending or state['done'] or
+                            (state['waiting'] and not idle)
+                        ))
+
+                        if not pending:
+                            if state['done']:
+                                return
+                            idle = True
+                        else:
+                            idle = False
+                            key, _, future = pending[0]
+
+                    if idle:
+                        yield None, None
+                        continue
+
+                    try:
+                        res = future.result()
+                    except Exception as exc:
+                        res = exc
+
+                    with cond:
+                        pending.popleft()
+                        if not isinstance(res, Exception):
+                            self._in_use[key] = res['nbytes']
+                        cond.notify_all()
+
+                    yield key, res
+            finally:
+                # the producer may be blocked pulling a key; it's a daemon
+                # thread and won't submit anything more once it sees stop
+                with cond:
+                    state['stop'] = True
+                    cond.notify_all()
 
 
 #
@@ -205,113 +926,680 @@ class FileTask:
 #
 
 class Transcriber(ABC):
-    def __init__(self, bucket: str, tasks: Dict[str, pd.DataFrame],
-                 aws_profile: str, model: Any,
-                 cache_dir: str = None, cache_only: bool = False,
-                 check_cache_on_start: bool = True, progress: bool = True):
+    progress_desc = 'Transcribe'
+
+    def __init__(self, tasks: Mapping[str, pd.DataFrame], model: Any,
+                 bucket: Optional[str] = None, aws_profile: Optional[str] = None,
+                 storage: Optional[str] = None, cache_dir: str = None,
+                 cache_format: Optional[str] = None, output_format: str = 'json',
+                 cache_only: bool = False,
+                 check_cache_on_start: bool = True, progress: bool = True,
+                 decode_once: bool = True, range_decode: bool = True,
+                 audio_backend: str = DEFAULT_AUDIO_BACKEND,
+                 pcm_cache_dir: Optional[str] = None,
+                 pcm_cache_bytes: int = 100 * 2**30,
+                 batch_size: Optional[int] = None, batch_keys: int = 4,
+                 prefetch: int = 2, io_threads: int = 2,
+                 prefetch_bytes: int = 256 * 2**20,
+                 timing_dir: Optional[str] = None,
+                 model_settings: Optional[Dict[str, Any]] = None,
+                 vad: Optional[str] = None,
+                 vad_options: Optional[Dict[str, Any]] = None,
+                 coalesce_gap: Optional[float] = None,
+                 coalesce_max: float = 300.0,
+                 variants: Optional[list] = None,
+                 cascade: Optional[list] = None,
+                 escalate_log_prob: float = -1.0,
+                 escalate_no_speech: float = 0.6):
         super().__init__()
 
         if not cache_dir and cache_only:
             raise ValueError('Must specify cache_dir for cache_only')
+        if not (bucket or storage):
+            raise ValueError('Must specify bucket or storage')
+        if vad is not None and vad not in VAD_METHODS:
+            raise ValueError(f'Invalid vad {vad}')
+        if coalesce_gap is not None and not decode_once:
+            raise ValueError('coalesce_gap requires decode_once')
+        if audio_backend not in AUDIO_BACKENDS:
+            raise ValueError(f'Invalid audio_backend {audio_backend}')
+        if audio_backend == 'av' and av is None:
+            raise ValueError("audio_backend 'av' needs PyAV installed")
 
         self.bucket = bucket
         self.tasks = tasks
         self.aws_profile = aws_profile
+
+        # a URI rather than an object, so it pickles into worker processes
+        self.storage_uri = storage if storage else f's3://{bucket}'
         self.model = model
         self.cache_dir = cache_dir
         self.cache_only = cache_only
         self.check_cache_on_start = check_cache_on_start
         self.progress = progress
-
-        if self.cache_dir:
-            os.makedirs(self.cache_dir, exist_ok=True)
-
-        self.session = boto3.Session(profile_name=self.aws_profile)
-        self.client = self.session.client('s3')
+        self.decode_once = decode_once
+        self.range_decode = range_decode
+        self.audio_backend = audio_backend
+
+        # decoded audio kept on local disk across runs, up to
+        # pcm_cache_bytes; see pcm_cache.py
+        self.pcm_cache_dir = pcm_cache_dir
+        self.pcm_cache = PcmCache(pcm_cache_dir, pcm_cache_bytes) if pcm_cache_dir else None
+
+        # batch_size=None transcribes one snippet per model call; otherwise
+        # the sections of batch_keys keys at a time are batched together
+        self.batch_size = batch_size
+        self.batch_keys = batch_keys if batch_size else 1
+
+        # vad: None, or a VAD_METHODS name; non-speech is cut from each
+        # section on the loading threads, before it reaches the model
+        self.vad = vad
+        self.vad_options = vad_options or {}
+
+        # coalesce_gap: None, or sections of a key at most this many
+        # seconds apart are transcribed as one span of up to coalesce_max
+        # seconds, and the result split back up by word timestamps
+        self.coalesce_gap = coalesce_gap
+        self.coalesce_max = coalesce_max
+
+        # keys decoded ahead of the model on io_threads threads (0 to
+        # disable). A key's audio counts against prefetch_bytes from its
+        # decode until it has been transcribed, so a process holds at most
+        # that much, or one file if a single one is bigger.
+        self.prefetch = prefetch
+        self.io_threads = io_threads
+        self.prefetch_bytes = prefetch_bytes
+
+        # cumulative seconds per pipeline stage, and of audio transcribed;
+        # with a timing_dir, also per-key and per-section records there
+        self.stage_times = collections.Counter()
+        self._stage_lock = threading.Lock()
+
+        # variants: None, or one Transcriber per model, each with its own
+        # cache, to fan the audio this one loads out to (see model_variants)
+        self.variants = variants or []
+
+        # cascade: None, or [(name, model), ...] of bigger models to rerun a
+        # section on, in turn, while its result from the one before has an
+        # average log prob below escalate_log_prob or a no-speech prob
+        # above escalate_no_speech (see needs_escalation)
+        self.cascade = cascade or []
+        self.escalate_log_prob = escalate_log_prob
+        self.escalate_no_speech = escalate_no_speech
+        self._cascade_batched = {}
+
+        self.model_settings = dict(model_settings or {}, batch_size=batch_size,
+                                   vad_method=vad, coalesce_gap=coalesce_gap,
+                                   audio_backend=audio_backend,
+                                   cascade=','.join(n for n, _ in self.cascade) or None)
+        self.timing_dir = timing_dir
+        self.timing = TimingLog(timing_dir, self.model_settings) if timing_dir else None
+
+        if self.cache_dir and not self.variants:
+            # output_format only affects writes; reads take either encoding
+            self.cache = open_cache(self.cache_dir, cache_format, output_format)
+
+        self.storage = get_storage(self.storage_uri, aws_profile=self.aws_profile)
+
+    @property
+    def namespace(self):
+        return model_namespace(self.model_settings.get('whisper_version'),
+                               self.model_settings.get('compute_type'))
 
     def transcribe(self, key):
-        if self.is_cached(key):
-            return None if self.cache_only else self.read_from_cache(key)
+        return self.transcribe_keys([key])[key]
 
+    def _file_task(self, key, sections=None):
         task = FileTask(
-            bucket=self.bucket,
+            storage=self.storage,
             key=key,
-            sections=self.tasks[key],
-            client=self.client,
+            sections=sections if sections is not None else self.tasks[key],
+            decode_once=self.decode_once,
+            range_decode=self.range_decode,
+            audio_backend=self.audio_backend,
+            pcm_cache=self.pcm_cache,
+        )
+
+        if self.coalesce_gap is not None:
+            task.merge_gap = max(task.merge_gap, self.coalesce_gap)
+
+        return task
+
+    def _estimate_bytes(self, key, sr=16000):
+        # a full decode is at least as long as the last section ends
+        sections = self.tasks[key]
+        end = (sections['offset'] + sections['duration']).max()
+
+        return int(end * sr) * np.dtype(np.float32).itemsize
+
+    def _load(self, key):
+        sections = self.missing_sections(key)
+        if sections.shape[0] == 0:
+            return {'key': key, 'cached': True, 'nbytes': 0}
+
+        task = self._file_task(key, sections)
+        if self.coalesce_gap is not None:
+            items = list(task.iter_coalesced(self.coalesce_gap, self.coalesce_max))
+        else:
+            items = list(task)
+        self._add_stage_time('fetch', task.fetch_time)
+        self._add_stage_time('decode', task.decode_time - task.fetch_time)
+
+        times = {}
+        if self.vad:
+            with self._stage('vad', times):
+                items = [self._apply_vad(item) for item in items]
+
+        return {
+            'key': key,
+            'cached': False,
+            'partial': sections.shape[0] < self.tasks[key].shape[0],
+            'items': items,
+            'nbytes': task.decoded_bytes + sum(
+                item['audio'].nbytes for item in items if 'vad' in item
+            ),
+            'fetch': task.fetch_time,
+            'decode': task.decode_time - task.fetch_time,
+            'vad': times.get('vad', 0.0),
+            'decode_mode': task.decode_mode,
+        }
+
+    def _apply_vad(self, item, sr=16000):
+        spans = VAD_METHODS[self.vad](item['audio'], sr=sr, **self.vad_options)
+        audio, vad_map = vad_trim(item['audio'], spans)
+
+        duration = item['audio'].shape[0] / sr
+        return dict(item, audio=audio, vad={
+            'map': vad_map,
+            'duration': duration,
+            'skipped': duration - audio.shape[0] / sr,
+        })
+
+    @staticmethod
+    def _item_sections(item, sr=16000):
+        # (id, seconds) of each section in the item, before any VAD trimming
+        if 'sections' in item:
+            return [(id, end - start) for id, start, end in item['sections']]
+        if 'vad' in item:
+            return [(item['id'], item['vad']['duration'])]
+        return [(item['id'], item['audio'].shape[0] / sr)]
+
+    def _audio_secs(self, item):
+        return sum(secs for _, secs in self._item_sections(item))
+
+    def _try_load(self, key):
+        try:
+            return self._load(key)
+        except Exception as exc:
+            return exc
+
+    def iter_loaded(self, keys, on_error=None):
+        if self.prefetch:
+            loads = Prefetcher(
+                load=self._load,
+                keys=keys,
+                estimate=self._estimate_bytes,
+                n_threads=self.io_threads,
+                depth=self.prefetch,
+                max_bytes=self.prefetch_bytes,
+            )
+        else:
+            loads = ((key, self._try_load(key)) for key in keys)
+
+        # see _transcribe_group()
+        release = loads.release if self.prefetch else (lambda key: None)
+
+        # the time spent waiting here is time the model sat idle
+        group = []
+        for (key, loaded), wait in self._timed(loads, 'wait'):
+            if key is None:
+                # nothing more to come for now; don't sit on a partial batch
+                if group:
+                    yield group
+                    group = []
+                continue
+
+            if isinstance(loaded, Exception):
+                logger.error(f'Unhandled exception loading {key}', exc_info=loaded)
+                if on_error:
+                    on_error(key)
+                continue
+
+            group += [dict(loaded, wait=wait, release=partial(release, key))]
+            if len(group) == self.batch_keys:
+                yield group
+                group = []
+
+        if group:
+            yield group
+
+    @cached_property
+    def batched_model(self):
+        return BatchedInferencePipeline(model=self.model)
+
+    def _tier_models(self, tier):
+        # (model, batched pipeline) of a cascade tier, 0 being self.model
+        if tier == 0:
+            return self.model, (self.batched_model if self.batch_size else None)
+
+        model = self.cascade[tier - 1][1]
+        if self.batch_size and tier not in self._cascade_batched:
+            self._cascade_batched[tier] = BatchedInferencePipeline(model=model)
+
+        return model, self._cascade_batched.get(tier)
+
+    def _transcribe_items(self, items, tier=0):
+        # yields lists of (index, segments, info) as results become available
+        model, batched_model = self._tier_models(tier)
+
+        todo, empty = [], []
+        for i, item in enumerate(items):
+            (todo if item['audio'].shape[0] > 0 else empty).append(i)
+
+        # nothing to run the model on, e.g. VAD found no speech
+        if empty:
+            yield [
+                (i, [], {'language': None, 'duration': 0.0, 'duration_after_vad': 0.0})
+                for i in empty
+            ]
+
+        if not self.batch_size:
+            for i in todo:
+                yield [(i, *transcribe_audio(model, items[i]['audio']))]
+            return
+
+        # length-bucketed: similar-length sections share a batch, so the
+        # decoder isn't held up by one long section in a batch of short ones
+        order = sorted(todo, key=lambda i: items[i]['audio'].shape[0])
+
+        for b in range(0, len(order), self.batch_size):
+            inds = order[b:(b+self.batch_size)]
+
+            segs, infos = transcribe_audio_batch(
+                batched_model,
+                [items[i]['audio'] for i in inds],
+                batch_size=self.batch_size,
+            )
+
+            yield list(zip(inds, segs, infos))
+
+    def _select_missing(self, loaded):
+        # the part of a key loaded for all variants that this one's cache
+        # is missing; a coalesced span goes if any of its sections is
+        if loaded['cached']:
+            return loaded
+
+        sections = self.missing_sections(loaded['key'])
+        missing = set(sections['id'].astype(str))
+        items = [
+            item for item in loaded['items']
+            if any(str(id) in missing for id, _ in self._item_sections(item))
+        ]
+
+        return dict(
+            loaded,
+            items=items,
+            cached=not items,
+            partial=sections.shape[0] < self.tasks[loaded['key']].shape[0],
+        )
+
+    def _fan_out(self, group):
+        # {key: {namespace: results}}, running each model in turn on the
+        # same decoded audio
+        ret = {}
+        for variant in self.variants:
+            res = variant.transcribe_loaded([variant._select_missing(g) for g in group])
+            for key, items in res.items():
+                ret.setdefault(key, {})[variant.namespace] = items
+
+        return ret
+
+    def _cascaded(self, items):
+        # _transcribe_items, with each result's info saying which model
+        # ('tier' 0 for self.model, 1 for cascade[0], ...) produced it and
+        # results that need it rerun up the cascade
+        names = [self.namespace] + [name for name, _ in self.cascade]
+
+        for results in self._transcribe_items(items):
+            results = {i: (segs, dict(info, tier=0, model=names[0]))
+                       for i, segs, info in results}
+
+            for tier in range(1, len(names)):
+                retry = [i for i, (segs, _) in results.items()
+                         if self.needs_escalation(segs)]
+                if not retry:
+                    break
+
+                for batch in self._transcribe_items([items[i] for i in retry], tier):
+                    for j, segs, info in batch:
+                        results[retry[j]] = (segs, dict(info, tier=tier, model=names[tier]))
+
+            yield [(i, segs, info) for i, (segs, info) in results.items()]
+
+    def needs_escalation(self, segments):
+        # whether a section's result looks unreliable: an average log prob
+        # (weighted by segment length) below escalate_log_prob, or a mean
+        # no-speech prob above escalate_no_speech. Nothing transcribed at
+        # all isn't escalated; that's what VAD and no_speech are for.
+        if not segments:
+            return False
+
+        lengths = np.array([max(s['end'] - s['start'], 1e-3) for s in segments])
+        log_probs = np.array([s.get('avg_log_prob', s.get('avg_logprob')) for s in segments],
+                             dtype=float)
+        no_speech = np.array([s['no_speech_prob'] for s in segments], dtype=float)
+
+        return bool(
+            np.average(log_probs, weights=lengths) < self.escalate_log_prob or
+            np.average(no_speech, weights=lengths) > self.escalate_no_speech
+        )
+
+    def transcribe_loaded(self, group):
+        if self.variants:
+            return self._fan_out(group)
+
+        ret, items = {}, []
+        for loaded in group:
+            key = loaded['key']
+
+            if self.cache_only:
+                ret[key] = None
+            elif loaded['cached'] or loaded['partial']:
+                ret[key] = self.read_from_cache(key)
+            else:
+                ret[key] = []
+
+            if not loaded['cached']:
+                items += [dict(item, key=key) for item in loaded['items']]
+                self._log_key(loaded)
+
+        # each snippet (or batch) is committed as soon as it's done, so a
+        # crash only loses the work in flight and a rerun picks up from there
+        asr = self._cascaded(items) if self.cascade else self._transcribe_items(items)
+        for results, asr_time in self._timed(asr, 'asr'):
+            done, times = {}, {}
+            for i, segs, info in results:
+                item = items[i]
+
+                res = dict(info, id=item['id'], segments=segs)
+                if 'vad' in item:
+                    res = self._undo_vad(res, item['vad'])
+                if 'sections' in item:
+                    res = self._split_coalesced(res, item)
+                else:
+                    res = [res]
+
+                done.setdefault(item['key'], []).extend(res)
+
+            for key, res in done.items():
+                times[key] = {}
+                if self.cache_dir:
+                    self.write_to_cache(key, res, times[key])
+
+                if not self.cache_only:
+                    ret[key] += res
+
+            self._add_stage_time('audio', sum(
+                self._audio_secs(items[i]) for i, _, _ in results
+            ))
+            self._log_sections(items, results, asr_time, times)
+
+        return ret
+
+    def model_stage_times(self):
+        # {namespace: stage times} for each model of a multi-model run
+        return {variant.namespace: dict(variant.stage_times)
+                for variant in self.variants}
+
+    @staticmethod
+    def _undo_vad(res, vad):
+        # timestamps back on the section's timeline, and durations as
+        # faster-whisper reports them for its own vad_filter
+        return dict(
+            res,
+            segments=[remap_segment_json(seg, vad['map']) for seg in res['segments']],
+            duration=vad['duration'],
+            duration_after_vad=vad['duration'] - vad['skipped'],
+            vad_skipped=vad['skipped'],
+        )
+
+    @staticmethod
+    def _split_coalesced(res, item):
+        # one result per section of the span, as if each had been
+        # transcribed by itself
+        pieces = split_segments_json(
+            res['segments'],
+            [(start, end) for _, start, end in item['sections']],
         )
 
         ret = []
-        for item in task:
-            segs, info = self.model.transcribe(item['audio'], word_timestamps=True)
-            info = dict(info._asdict(), id=item['id'])
-            segs = list(segs)  # it's a generator; ASR happens here
+        for (id, start, end), segs in zip(item['sections'], pieces):
+            piece = dict(res, id=id, segments=segs, duration=end - start,
+                         duration_after_vad=end - start,
+                         coalesced=len(item['sections']))
 
-            ret += [whisper_to_json(segs, info)]
+            if 'vad' in item:
+                vad = item['vad']
+                speech = vad_speech_secs(vad['map'], vad['duration'] - vad['skipped'],
+                                         start, end)
+                piece.update(duration_after_vad=speech, vad_skipped=end - start - speech)
 
-        if self.cache_dir:
-            self.write_to_cache(key, ret)
+            ret += [piece]
 
-        return None if self.cache_only else ret
+        return ret
+
+    def _log_key(self, loaded):
+        if self.timing is None:
+            return
+
+        self.timing.write({
+            'type': 'key',
+            'key': loaded['key'],
+            'n_sections': sum(
+                len(self._item_sections(item)) for item in loaded['items']
+            ),
+            'audio_secs': sum(self._audio_secs(item) for item in loaded['items']),
+            'vad_skipped': sum(
+                item['vad']['skipped'] for item in loaded['items'] if 'vad' in item
+            ),
+            'decode_mode': loaded['decode_mode'],
+            'decoded_bytes': loaded['nbytes'],
+            'fetch': loaded['fetch'],
+            'decode': loaded['decode'],
+            'vad': loaded['vad'],
+            'wait': loaded.get('wait', 0.0),
+        })
+
+    def _log_sections(self, items, results, asr_time, times):
+        # A batch's ASR time, and a key's serialize and write times, are
+        # shared out among its items in proportion to their audio
+        if self.timing is None:
+            return
+
+        def shares(inds):
+            audio = np.array([items[i]['audio'].shape[0] for i in inds], dtype=float)
+            total = audio.sum()
+            return audio / total if total > 0 else np.full(len(inds), 1 / len(inds))
+
+        inds = [i for i, _, _ in results]
+        tiers = {i: info.get('tier') for i, _, info in results}
+        by_key = {}
+        for i in inds:
+            by_key.setdefault(items[i]['key'], []).append(i)
+
+        asr_shares = dict(zip(inds, shares(inds)))
+        for key, key_inds in by_key.items():
+            for i, share in zip(key_inds, shares(key_inds)):
+                # and a coalesced span's among its sections, by length
+                sections = self._item_sections(items[i])
+                total = sum(secs for _, secs in sections)
+                skipped = items[i]['vad']['skipped'] if 'vad' in items[i] else 0.0
+
+                for id, secs in sections:
+                    frac = secs / total if total > 0 else 1 / len(sections)
+
+                    self.timing.write({
+                        'type': 'section',
+                        'key': key,
+                        'id': str(id),
+                        'audio_secs': secs,
+                        'vad_skipped': skipped * frac,
+                        'batch': len(inds),
+                        'coalesced': len(sections),
+                        'tier': tiers[i],
+                        'asr': asr_time * asr_shares[i] * frac,
+                        'serialize': times[key].get('serialize', 0.0) * share * frac,
+                        'write': times[key].get('write', 0.0) * share * frac,
+                    })
+
+    def _add_stage_time(self, stage, secs):
+        with self._stage_lock:
+            self.stage_times[stage] += secs
+
+    @contextlib.contextmanager
+    def _stage(self, stage, times=None):
+        # charge the time spent in the block to the stage, and to times
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            secs = time.perf_counter() - t0
+            self._add_stage_time(stage, secs)
+            if times is not None:
+                times[stage] = times.get(stage, 0.0) + secs
+
+    def _timed(self, iterable, stage):
+        # yields (element, seconds spent producing it), charging the
+        # seconds to the given stage
+        it = iter(iterable)
+        while True:
+            times = {}
+            try:
+                with self._stage(stage, times):
+                    item = next(it)
+            except StopIteration:
+                return
+
+            yield item, times[stage]
+
+    def transcribe_keys(self, keys):
+        return self.transcribe_loaded([self._load(key) for key in keys])
+
+    def _transcribe_group(self, group):
+        # a group from iter_loaded(), whose audio goes back to the prefetch
+        # budget once it's done with, whether or not that worked
+        try:
+            return self.transcribe_loaded(group)
+        finally:
+            for loaded in group:
+                loaded['release']()
+
+    def iter_transcribed(self, keys, on_error=None):
+        for group in self.iter_loaded(keys, on_error=on_error):
+            try:
+                res = self._transcribe_group(group)
+            except Exception as exc:
+                logger.exception('Unhandled exception in transcribe')
+                if on_error:
+                    for loaded in group:
+                        on_error(loaded['key'])
+                continue
+
+            yield from res.items()
 
     @cached_property
     def start_cache(self):
         if not self.cache_dir:
             return None
 
-        return {
-            os.path.relpath(root, self.cache_dir)
-            for root, dirs, _ in os.walk(self.cache_dir)
-            if not dirs
-        }
+        return self.cache.cached_sections()
 
-    def is_cached(self, key):
+    def missing_sections(self, key):
+        sections = self.tasks[key]
+        if self.variants:
+            # missing from any of the models' caches
+            missing = set().union(*(
+                set(v.missing_sections(key)['id'].astype(str)) for v in self.variants
+            ))
+            return sections.loc[sections['id'].astype(str).isin(missing), :]
         if not self.cache_dir:
-            return None
+            return sections
 
+        done = set()
         if self.check_cache_on_start and self.start_cache is not None:
-            if key in self.start_cache:
-                return True
+            done = self.start_cache.get(key, set())
 
-        key_path = os.path.join(self.cache_dir, key)
-        return os.path.exists(key_path)
+        missing = ~sections['id'].astype(str).isin(done)
+        if missing.any():  # the snapshot may be stale; ask the cache
+            missing = ~sections['id'].astype(str).isin(self.cache.cached_ids(key))
 
-    def write_to_cache(self, key, res):
-        assert self.cache_dir is not None
+        return sections.loc[missing, :]
+
+    def is_cached(self, key):
+        if not self.cache_dir:
+            return None
 
-        key_path = os.path.join(self.cache_dir, key)
-        os.makedirs(key_path, exist_ok=True)
+        return self.missing_sections(key).shape[0] == 0
 
-        for item in res:
-            item_path = os.path.join(key_path, f"{item['id']}.json")
+    def write_to_cache(self, key, res, times=None):
+        assert self.cache_dir is not None
 
-            with open(item_path, 'wt') as f:
-                json.dump(item, f)
+        with self._stage('serialize', times):
+            data = self.cache.encode(key, res)
+        with self._stage('write', times):
+            self.cache.write_encoded(key, data)
 
     def read_from_cache(self, key):
         assert self.cache_dir is not None
 
-        if not self.is_cached(key):
+        if not self.cache.is_cached(key):
             raise RuntimeError(f'File {key} has not been processed yet')
 
-        key_path = os.path.join(self.cache_dir, key)
+        return self.cache.read(key)
 
-        ret = []
-        for obj in os.listdir(key_path):
-            item_path = os.path.join(key_path, obj)
+    def key_groups(self, keys):
+        for i in range(0, len(keys), self.batch_keys):
+            yield keys[i:(i+self.batch_keys)]
 
-            with open(item_path, 'rt') as f:
-                ret += [json.load(f)]
+    def _run_keys(self, keys=None):
+        if keys is None:
+            keys = list(self.tasks.keys())
+            np.random.shuffle(keys)  # representative timing estimates
 
-        return ret
+        return keys
 
-    @abstractmethod
-    def run(self):
-        raise NotImplementedError()
+    def iter_results(self, keys=None, on_error=None):
+        # (key, results) as each key is done, results None if cache_only;
+        # on_error(key) if it failed
+        yield from self.iter_transcribed(self._run_keys(keys), on_error=on_error)
+
+    def run(self, callback=None, keys=None, on_error=None):
+        # callback(key) after each key is done, on_error(key) if it failed
+        ret = 0 if self.cache_only else []
+        with tqdm(
+            total=len(self.tasks),
+            desc=self.progress_desc, unit='task',
+            disable=(not self.progress),
+        ) as pbar:
+            for key, res in self.iter_results(keys, on_error=on_error):
+                ret += 1 if self.cache_only else [res]
+
+                pbar.update(1)
+                if callback:
+                    callback(key)
+
+        if self.variants and self.progress:
+            # pool workers run without progress; their parent reports
+            report_models(self.model_stage_times())
+
+        return ret
 
 
 class CudaTranscriber(Transcriber):
+    progress_desc = 'CUDA transcribe'
+
     def __init__(self, whisper_version='base', compute_type='auto',
-                 cuda_devices='auto', **kwargs):
+                 cuda_devices='auto', models=None, cascade=None, **kwargs):
         if cuda_devices == 'auto':
             cuda_devices = list(get_free_gpus(min_memory_mb=1024).keys())
         if len(cuda_devices) == 0:
@@ -319,123 +1607,282 @@ class CudaTranscriber(Transcriber):
 
         self.num_workers = len(cuda_devices)
 
-        kwargs['model'] = WhisperModel(
-            whisper_version,
-            device_index=cuda_devices,
-            num_workers=self.num_workers,
-            compute_type=compute_type,
-        )
+        def load(whisper_version, compute_type):
+            return WhisperModel(
+                whisper_version,
+                device_index=cuda_devices,
+                num_workers=self.num_workers,
+                compute_type=compute_type,
+            )
+
+        if models and cascade:
+            raise ValueError('Use either models or cascade, not both')
+
+        if models:
+            kwargs['variants'] = model_variants(CudaTranscriber, models, kwargs,
+                                                cuda_devices=cuda_devices)
+            kwargs['model'] = None
+        else:
+            kwargs['model'] = load(whisper_version, compute_type)
+            kwargs['cascade'] = [(model_namespace(*m), load(*m)) for m in cascade or []]
+        kwargs['model_settings'] = {
+            'whisper_version': whisper_version,
+            'compute_type': compute_type,
+            'device': 'cuda',
+        }
 
         super().__init__(**kwargs)
 
-    def run(self, callback=None):
-        keys = list(self.tasks.keys())
-        np.random.shuffle(keys)  # representative timing estimates
+    def iter_results(self, keys=None, on_error=None, max_in_flight=None):
+        # (key, results) as each key is done, in completion order. At most
+        # max_in_flight keys (default two groups per GPU thread) are with
+        # the executor at once, and their audio counts against
+        # prefetch_bytes until they're transcribed, so memory stays flat
+        # however many keys there are, as long as the caller doesn't keep
+        # the results.
+        if max_in_flight is None:
+            max_in_flight = 2 * self.num_workers * self.batch_keys
 
-        with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
-            futures = []
-            with tqdm(
-                total=len(self.tasks),
-                desc='CUDA thread submit', unit='task',
-                disable=(not self.progress)
-            ) as pbar:
-                for key in keys:
-                    futures += [executor.submit(self.transcribe, key)]
-                    pbar.update(1)
-
-            ret = 0 if self.cache_only else []
-            with tqdm(
-                as_completed(futures),
-                total=len(futures),
-                desc='CUDA transcribe', unit='task',
-                disable=(not self.progress),
-            ) as pbar:
-                for future in as_completed(futures):
-                    try:
-                        res = future.result()
+        def collect(futures):
+            for future in futures:
+                group_keys = in_flight.pop(future)
 
-                        ret += 1 if self.cache_only else [res]
+                try:
+                    res = future.result()
+                except Exception as exc:
+                    logger.exception('Unhandled exception in thread')
+                    if on_error:
+                        for key in group_keys:
+                            on_error(key)
+                    continue
 
-                        pbar.update(1)
-                        if callback:
-                            callback()
-                    except Exception as exc:
-                        logger.exception('Unhandled exception in thread')
+                yield from res.items()
+
+        with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+            in_flight = {}  # future -> its group's keys
+            for group in self.iter_loaded(self._run_keys(keys), on_error=on_error):
+                future = executor.submit(self._transcribe_group, group)
+                in_flight[future] = [loaded['key'] for loaded in group]
 
-            return ret
+                while sum(map(len, in_flight.values())) >= max_in_flight:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    yield from collect(done)
+
+            yield from collect(as_completed(list(in_flight)))
 
 
 class CpuTranscriber(Transcriber):
-    def __init__(self, whisper_version='base', compute_type='auto', **kwargs):
-        kwargs['model'] = WhisperModel(
-            whisper_version,
-            device='cpu',
-            num_workers=1,
-            compute_type=compute_type,
-        )
+    progress_desc = 'CPU transcribe'
+
+    def __init__(self, whisper_version='base', compute_type='auto',
+                 cpu_threads=0, models=None, cascade=None, **kwargs):
+        def load(whisper_version, compute_type):
+            return WhisperModel(
+                whisper_version,
+                device='cpu',
+                num_workers=1,
+                cpu_threads=cpu_threads,
+                compute_type=compute_type,
+            )
+
+        if models and cascade:
+            raise ValueError('Use either models or cascade, not both')
+
+        if models:
+            kwargs['variants'] = model_variants(CpuTranscriber, models, kwargs,
+                                                cpu_threads=cpu_threads)
+            kwargs['model'] = None
+        else:
+            kwargs['model'] = load(whisper_version, compute_type)
+            kwargs['cascade'] = [(model_namespace(*m), load(*m)) for m in cascade or []]
+        kwargs['model_settings'] = {
+            'whisper_version': whisper_version,
+            'compute_type': compute_type,
+            'device': 'cpu',
+            'cpu_threads': cpu_threads,
+        }
 
         super().__init__(**kwargs)
 
-    def run(self, callback=None):
-        keys = list(self.tasks.keys())
-        np.random.shuffle(keys)  # representative timing estimates
 
-        ret = 0 if self.cache_only else []
-        with tqdm(
-            keys,
-            desc='CPU transcribe', unit='task',
-            disable=(not self.progress),
-        ) as pbar:
-            for key in keys:
-                try:
-                    res = self.transcribe(key)
+def model_namespace(whisper_version, compute_type):
+    return f'{whisper_version}-{compute_type}'
 
-                    ret += 1 if self.cache_only else [res]
+def model_cache_dir(cache_dir, whisper_version, compute_type):
+    if cache_dir is None:
+        return None
 
-                    pbar.update(1)
-                    if callback:
-                        callback()
-                except Exception as exc:
-                    logger.exception('Unhandled exception in transcribe')
+    return os.path.join(cache_dir, model_namespace(whisper_version, compute_type))
 
-        return ret
+def model_variants(kls, models, kwargs, **model_kwargs):
+    # Comparing models in one pass: a transcriber per (whisper_version,
+    # compute_type) in models, all sharing one tasks dict, each writing to
+    # <cache_dir>/<whisper_version>-<compute_type> and its own timing
+    # records. Only their parent loads audio, so they don't prefetch.
+    return [
+        kls(
+            whisper_version=whisper_version,
+            compute_type=compute_type,
+            **model_kwargs,
+            **dict(
+                kwargs,
+                cache_dir=model_cache_dir(kwargs.get('cache_dir'),
+                                          whisper_version, compute_type),
+                progress=False,
+                prefetch=0,
+            ),
+        )
+        for whisper_version, compute_type in models
+    ]
 
 
-def initializer(cnt):
-    global counter
+def report_models(model_stage_times):
+    # a line per model of a multi-model run: its ASR time against the audio
+    # it transcribed
+    for namespace, times in model_stage_times.items():
+        asr, audio = times.get('asr', 0.0), times.get('audio', 0.0)
+        rtf = asr / audio if audio > 0 else float('nan')
+        logger.info(f'{namespace}: {asr:.1f}s asr, {audio:.0f}s audio, RTF {rtf:.3f}')
 
-    counter = cnt
 
-def worker(batch):
-    global counter
+def initializer(cnt, queue, worker_type, worker_kwargs, slots=None, done=None,
+                started=None):
+    # Runs once per pool process: the model is loaded here and then serves
+    # every key the process pulls off the queue for the life of the job.
+    # If given, (key, succeeded) goes on the done queue as each key ends,
+    # and each worker() task waits at the started barrier for the rest.
+    global counter, work_queue, done_queue, start_barrier, transcriber, worker_stats
+
+    counter = cnt
+    work_queue = queue
+    done_queue = done
+    start_barrier = started
+    transcriber = None
+
+    worker_stats = {
+        'worker_type': worker_type,
+        'pid': os.getpid(),
+        'start': time.time(),
+        'keys': 0,
+        'audio_secs': 0.0,
+    }
 
     try:
+        cpu_threads = worker_kwargs.get('cpu_threads', 0)
+        if worker_type == 'cpu' and cpu_threads:
+            # ctranslate2 gets cpu_threads from the transcriber; torch was
+            # imported before this ran, so only set_num_threads reaches it
+            torch.set_num_threads(cpu_threads)
+
+            if slots is not None and hasattr(os, 'sched_setaffinity'):
+                with slots.get_lock():
+                    slot = slots.value
+                    slots.value += 1
+
+                cores = sorted(os.sched_getaffinity(0))
+                cores = cores[(slot * cpu_threads):((slot + 1) * cpu_threads)]
+                if cores:
+                    os.sched_setaffinity(0, cores)
+
         # one pbar, not one per process
-        batch['worker_kwargs']['progress'] = False
+        worker_kwargs = dict(worker_kwargs, progress=False)
 
-        if batch['worker_type'] == 'cpu':
-            transcriber = CpuTranscriber(**batch['worker_kwargs'])
-        elif batch['worker_type'] == 'gpu':
-            transcriber = CudaTranscriber(**batch['worker_kwargs'])
+        if worker_type == 'cpu':
+            transcriber = CpuTranscriber(**worker_kwargs)
+        elif worker_type == 'gpu':
+            transcriber = CudaTranscriber(**worker_kwargs)
         else:
             raise ValueError("Invalid worker_type")
+    except Exception as exc:
+        # raising here would make the pool respawn the process forever
+        logger.exception('Unhandled exception in worker initializer')
+        worker_stats['error'] = repr(exc)
+
+    worker_stats['ready'] = time.time()
+
+def queue_keys(transcriber, queue, stats, in_flight):
+    # pull (key, sections) pairs until this worker's sentinel comes up,
+    # adding each key to in_flight until it's done or has failed
+    while True:
+        item = queue.get()
+        if item is None:
+            return
+
+        key, sections = item
+        transcriber.tasks[key] = sections
+        in_flight.add(key)
+
+        stats['keys'] += 1
+        stats['audio_secs'] += float(sections['duration'].sum())
+
+        yield key
+
+def worker(worker_id):
+    global counter, work_queue, done_queue, start_barrier, transcriber, worker_stats
+
+    if start_barrier is not None:
+        # a process whose initializer failed would return at once and take
+        # another process's task; holding each until all are taken means
+        # every process runs exactly one
+        start_barrier.wait()
 
+    stats = dict(worker_stats, worker=worker_id)
+    in_flight = set()
+
+    def finish(key):
+        # the worker lives for the whole job, so don't keep what it's done
+        in_flight.discard(key)
+        transcriber.tasks.pop(key, None)
+
+    def on_done(key):
+        finish(key)
         if counter is not None:
-            def update_counter():
-                with counter.get_lock():
-                    counter.value += 1
+            with counter.get_lock():
+                counter.value += 1
+        if done_queue is not None:
+            done_queue.put((key, True))
 
-            return transcriber.run(callback=update_counter)
-        else:
-            return transcriber.run()
+    def on_error(key):
+        finish(key)
+        if done_queue is not None:
+            done_queue.put((key, False))
+
+    ret = None
+    try:
+        if transcriber is None:
+            raise RuntimeError('Worker failed to initialize')
+
+        keys = queue_keys(transcriber, work_queue, stats, in_flight)
+        ret = transcriber.run(callback=on_done, keys=keys, on_error=on_error)
     except Exception as exc:
-        pass  # FIXME
+        logger.exception('Unhandled exception in worker')
+        stats['error'] = repr(exc)
+
+        # else their leases would be renewed, and waited on, forever
+        for key in list(in_flight):
+            on_error(key)
+
+    if transcriber is not None:
+        # a multi-model transcriber's models keep their own
+        stage_times = collections.Counter(transcriber.stage_times)
+        for variant in transcriber.variants:
+            stage_times.update(variant.stage_times)
+        stats['stage_times'] = dict(stage_times)
+        stats['model_stage_times'] = transcriber.model_stage_times()
+
+    stats['end'] = time.time()
+    return {'result': ret, 'stats': stats}
+
+
+# the stages in which a worker's model is doing work
+BUSY_STAGES = ('asr', 'serialize', 'write')
 
 
 class MultiTranscriber:
     def __init__(self, tasks, n_procs=None, cuda_devices='auto', gpu_share=0.5,
                  cache_only=False, check_cache_on_start=True, progress=True,
-                 **kwargs):
+                 cpu_threads=None, coordinator=None, lease_secs=600.0,
+                 claim_size=None, **kwargs):
         assert not (gpu_share == 0 and cuda_devices)
 
         super().__init__()
@@ -443,11 +1890,27 @@ class MultiTranscriber:
         self.tasks = tasks
         self.n_procs = n_procs if n_procs is not None else os.cpu_count()
         self.cuda_devices = cuda_devices
-        self.gpu_share = gpu_share
+        self.gpu_share = gpu_share  # > 0: one of the n_procs workers is a GPU one
         self.cache_only = cache_only
         self.check_cache_on_start = check_cache_on_start
         self.progress = progress
 
+        # coordinator: None to do every key in tasks, or the URI of a
+        # shared work table (see coordinator.py) to lease keys from,
+        # claim_size at a time, along with any number of other nodes
+        self.coordinator = coordinator
+        self.lease_secs = lease_secs
+        self.claim_size = claim_size if claim_size is not None else 2 * self.n_procs
+        self._done_keys = set()
+
+        # a worker only learns that no more keys are coming for now from
+        # the prefetcher, so without one it could sit on a partial batch
+        if coordinator and kwargs.get('batch_size') and not kwargs.get('prefetch', 2):
+            raise ValueError('coordinator with batch_size needs prefetch > 0')
+
+        self._cpu_threads = cpu_threads
+        self.worker_stats = None
+
         self._kwargs = kwargs
         self._kwargs['check_cache_on_start'] = False  # we do this here
 
@@ -456,98 +1919,260 @@ class MultiTranscriber:
             'cache_dir' in self._kwargs and
             self._kwargs['cache_dir'] is not None
         ):
+            # with several models, a section is done once all have it
+            cache_dirs = [
+                model_cache_dir(self._kwargs['cache_dir'], *model)
+                for model in self._kwargs.get('models') or []
+            ] or [self._kwargs['cache_dir']]
+
+            caches = [
+                open_cache(cache_dir, self._kwargs.get('cache_format')).cached_sections()
+                for cache_dir in cache_dirs
+            ]
             start_cache = {
-                os.path.relpath(root, self._kwargs['cache_dir'])
-                for root, dirs, _ in os.walk(self._kwargs['cache_dir'])
-                if not dirs
+                k: set.intersection(*[c.get(k, set()) for c in caches])
+                for k in caches[0]
             }
 
-            self.tasks = {
-                k: self.tasks[k]
-                for k in self.tasks.keys()
-                if k not in start_cache
-            }
+            # keep only the sections not yet written, so a restarted run
+            # does exactly the remaining work
+            if isinstance(self.tasks, TaskManifest):
+                tasks, n_partial = self._missing_manifest(start_cache)
+            else:
+                tasks, n_partial = {}, 0
+                for k, sections in self.tasks.items():
+                    done = start_cache.get(k, set())
+                    missing = sections.loc[~sections['id'].astype(str).isin(done), :]
+
+                    if missing.shape[0] > 0:
+                        tasks[k] = missing
+                        n_partial += 0 < len(done)
+
+            logger.info(f'Resuming: {len(self.tasks) - len(tasks)} keys done, '
+                        f'{n_partial} partly done, {len(tasks)} to do')
+            self._done_keys = self.tasks.keys() - tasks.keys()
+            self.tasks = tasks
+
+    def _missing_manifest(self, start_cache):
+        # the same filter over a manifest's columns, without a DataFrame
+        # per key
+        rows = self.tasks.to_frame()
+        done = np.fromiter(
+            (str(i) in start_cache.get(k, ()) for k, i in zip(rows['key'], rows['id'])),
+            dtype=bool, count=rows.shape[0],
+        )
 
-    @cached_property
-    def chunked_keys(self):
-        keys = list(self.tasks.keys())
-        np.random.shuffle(keys)
+        tasks = self.tasks.select(~done)
+        n_partial = sum(k in tasks for k in set(rows.loc[done, 'key']))
 
-        cpu_keys = keys[0:int(len(keys) * (1 - self.gpu_share))]
-        gpu_keys = keys[int(len(keys) * (1 - self.gpu_share)):len(keys)]
-        total = len(cpu_keys) + len(gpu_keys)
-        assert total == len(keys)
+        return tasks, n_partial
 
-        n_cpu_procs = self.n_procs - 1 if gpu_keys else self.n_procs
-        n_gpu_procs = self.n_procs - n_cpu_procs  # 0 xor 1
+    def _key_costs(self):
+        # {key: total section duration}
+        if isinstance(self.tasks, TaskManifest):
+            return self.tasks.durations()
 
-        worker_types = ['cpu'] * n_cpu_procs + ['gpu'] * n_gpu_procs
+        return {k: float(v['duration'].sum()) for k, v in self.tasks.items()}
 
-        worker_key_groups = []
-        if n_cpu_procs > 0:
-            worker_key_groups += [
-                c.tolist()
-                for c in np.array_split(cpu_keys, n_cpu_procs)
-            ]
-        if n_gpu_procs > 0:
-            worker_key_groups += [gpu_keys]
-        assert sum([len(c) for c in worker_key_groups]) == len(keys)
+    @cached_property
+    def ordered_keys(self):
+        # longest first, by total section duration, so the big keys start
+        # early and the short ones fill in the gaps at the end of the run
+        cost = self._key_costs()
+        return sorted(cost.keys(), key=lambda k: cost[k], reverse=True)
+
+    @property
+    def n_gpu_procs(self):
+        return 1 if self.gpu_share > 0 and self.cuda_devices else 0
 
-        return list(zip(worker_types, worker_key_groups))
+    @property
+    def n_cpu_procs(self):
+        return self.n_procs - self.n_gpu_procs
+
+    @property
+    def cpu_threads(self):
+        # split the cores evenly rather than letting every process's
+        # CTranslate2 default to all of them
+        if self._cpu_threads is not None:
+            return self._cpu_threads
+
+        return max(1, os.cpu_count() // max(self.n_cpu_procs, 1))
 
     def get_pbar(self):
         return tqdm(total=len(self.tasks.keys()), desc='CPU/GPU transcribe',
                     unit='task', disable=(not self.progress))
 
-    def run(self):
-        proc_args = []
-        for wtype, wkeys in self.chunked_keys:
-            worker_kwargs = dict(
-                self._kwargs,
-                progress=False,
-                cache_only=self.cache_only,
-                tasks={k: self.tasks[k] for k in wkeys},
+    def report(self, start, end):
+        wall = end - start
+
+        logger.info(f'{len(self.worker_stats)} workers, {wall:.1f}s wall time')
+        for stats in self.worker_stats:
+            # busy is time spent transcribing and committing results; the
+            # rest went to loading the model, waiting on audio or the queue
+            stage_times = stats.get('stage_times', {})
+            busy = sum(stage_times.get(stage, 0.0) for stage in BUSY_STAGES)
+            stats['busy_secs'] = busy
+            stats['idle_secs'] = max(wall - busy, 0.0)
+            stats['utilization'] = busy / wall if wall > 0 else 0.0
+
+            logger.info(
+                f"worker {stats['worker']:>3} ({stats['worker_type']}): "
+                f"{stats['keys']} keys, {stats['audio_secs']:.0f}s audio, "
+                f"busy {busy:.1f}s, idle {stats['idle_secs']:.1f}s, "
+                f"utilization {stats['utilization']:.1%}"
+                + (f", error {stats['error']}" if 'error' in stats else '')
             )
 
-            if wtype == 'gpu':
-                worker_kwargs['cuda_devices'] = self.cuda_devices
+        model_stage_times = {}
+        for stats in self.worker_stats:
+            for namespace, times in stats.get('model_stage_times', {}).items():
+                model_stage_times.setdefault(namespace, collections.Counter()).update(times)
+        report_models(model_stage_times)
+
+    def _stop_workers(self, queue):
+        for _ in range(self.n_procs):
+            queue.put(None)  # one sentinel per worker
+
+    def _feed_all(self, queue, done):
+        for key in self.ordered_keys:
+            queue.put((key, self.tasks[key]))
+        self._stop_workers(queue)
+
+        yield
+
+    def _feed_leased(self, queue, done):
+        # Called on every tick of the run loop: hands finished keys back
+        # to the coordinator, renews the leases on the rest and tops the
+        # queue up with new claims. The workers are only stopped once the
+        # shared table has nothing left that isn't done or failed, so a
+        # node that finishes early stays around to pick up the keys of
+        # one that died once their leases run out.
+        coord = open_coordinator(self.coordinator, lease_secs=self.lease_secs)
+        coord.add_keys(self._key_costs())
+
+        held, renewed = set(), time.time()
+        try:
+            while True:
+                finished, failed = [], []
+                while True:
+                    try:
+                        key, ok = done.get_nowait()
+                    except queue_mod.Empty:
+                        break
+                    (finished if ok else failed).append(key)
+
+                coord.complete(finished)
+                coord.release(failed, failed=True)
+                held -= set(finished) | set(failed)
+
+                if time.time() - renewed > self.lease_secs / 3:
+                    coord.renew(held)
+                    renewed = time.time()
+
+                claimed = []
+                if queue.qsize() < self.claim_size:
+                    claimed = coord.claim(self.claim_size)
+
+                for key in claimed:
+                    if key in self.tasks:
+                        queue.put((key, self.tasks[key]))
+                        held.add(key)
+                    elif key in self._done_keys:
+                        coord.complete([key])  # already in our cache
+                    else:
+                        logger.warning(f'Claimed {key}, which is not in tasks')
+                        coord.release([key], failed=True)
+
+                if not claimed and not held:
+                    counts = coord.counts()
+                    if not any(counts.get(s) for s in ('todo', 'leased', 'expired')):
+                        break
+
+                yield
+
+            logger.info(f'Work table drained: {coord.counts()}')
+            self._stop_workers(queue)
+            yield
+        finally:
+            # on the way out for any other reason, let other nodes have them
+            coord.release(held)
+            coord.close()
 
-            proc_args += [{
-                'worker_type': wtype,
-                'worker_kwargs': worker_kwargs
-            }]
+    def run(self):
+        # Every worker pulls keys off one shared queue until it's empty, so
+        # nobody sits idle while another works through a fixed backlog
+        queue = mp.Queue()
+        done = mp.Queue() if self.coordinator else None
+
+        feed = (self._feed_leased if self.coordinator else self._feed_all)(queue, done)
+        next(feed)
+
+        worker_kwargs = dict(
+            self._kwargs,
+            progress=False,
+            cache_only=self.cache_only,
+            tasks={},
+        )
 
         counter = mp.Value('i', 0) if self.progress else None
-        pool_kwargs = {
-            'processes': self.n_procs,
-            'maxtasksperchild': 1,
-            'initializer': initializer,
-            'initargs': (counter,),
-        }
-
-        with mp.Pool(**pool_kwargs) as pool:
-            with self.get_pbar() as pbar:
-                results = [
-                    pool.apply_async(worker, (batch,))
-                    for batch in proc_args
-                ]
+        slots = mp.Value('i', 0)  # hands out disjoint core sets
+
+        # one pool per worker type, since the model is built in the
+        # initializer; each process runs a single long-lived worker() task
+        pool_specs = []
+        if self.n_cpu_procs > 0:
+            pool_specs += [('cpu', self.n_cpu_procs,
+                            dict(worker_kwargs, cpu_threads=self.cpu_threads))]
+        if self.n_gpu_procs > 0:
+            pool_specs += [('gpu', self.n_gpu_procs,
+                            dict(worker_kwargs, cuda_devices=self.cuda_devices))]
+
+        start = time.time()
+        with contextlib.ExitStack() as stack:
+            results, worker_id = [], 0
+            for wtype, nprocs, kwargs in pool_specs:
+                pool = stack.enter_context(mp.Pool(
+                    processes=nprocs,
+                    initializer=initializer,
+                    initargs=(counter, queue, wtype, kwargs, slots, done,
+                              mp.Barrier(nprocs)),
+                ))
+
+                for _ in range(nprocs):
+                    results += [pool.apply_async(worker, (worker_id,))]
+                    worker_id += 1
 
                 pool.close()
 
-                if self.progress:
-                    while not all(res.ready() for res in results):
+            stack.callback(feed.close)
+
+            with self.get_pbar() as pbar:
+                while not all(res.ready() for res in results):
+                    next(feed, None)
+
+                    if self.progress:
                         with counter.get_lock():
                             pbar.n = counter.value
                             pbar.refresh()
-                        time.sleep(1)
 
-                pool.join()
+                    # a tick a second, or sooner if the workers are done;
+                    # the last one may finish between the check and here
+                    waiting = next((res for res in results if not res.ready()), None)
+                    if waiting is not None:
+                        waiting.wait(1)
 
                 ret = 0 if self.cache_only else []
+                self.worker_stats = []
                 for res in results:
                     tmp = res.get()
-                    ret += tmp if self.cache_only else [tmp]
-                return ret
+                    self.worker_stats += [tmp['stats']]
+
+                    if tmp['result'] is not None:
+                        ret += tmp['result'] if self.cache_only else [tmp['result']]
+
+        self.report(start, time.time())
+
+        return ret
 
 
 def parse_args():
@@ -558,13 +2183,72 @@ def parse_args():
     parser.add_argument('-c', '--cuda', action='store_true',
                         help='auto-select and use GPUs (default CPU)')
     parser.add_argument('-b', '--bucket', default='cortico-data')
+    parser.add_argument('-f', '--cache-format', default=None,
+                        choices=['dir', 'segments'],
+                        help="cache layout (default: 'segments' if the cache "
+                             "directory has a manifest, else 'dir')")
+    parser.add_argument('-O', '--output-format', default='json',
+                        choices=['json', 'columnar'],
+                        help="snippet encoding to write; 'columnar' is the "
+                             "compact binary one (see transcript_format.py)")
+    parser.add_argument('-S', '--storage', default=None,
+                        help='audio storage URI: s3://bucket, file:///dir or '
+                             'http(s)://host/prefix (default s3://<bucket>)')
     parser.add_argument('-a', '--aws-profile', default='cortico')
     parser.add_argument('-t', '--compute-type', default='auto')
     parser.add_argument('-w', '--whisper-version', default='base')
+    parser.add_argument('-M', '--models', nargs='+', default=None,
+                        help='compare models in one pass: whisper_version:'
+                             'compute_type pairs (e.g. base:int8 small:int8), '
+                             'each cached under <outdir>/<version>-<type>; '
+                             'overrides -w and -t')
     parser.add_argument('-v', '--verbose', action='store_true')
     parser.add_argument('-s', '--seed', default=2969591811, type=int)
     parser.add_argument('-n', '--n-splits', default=1, type=int)
     parser.add_argument('-l', '--split', default=0, type=int)
+    parser.add_argument('-k', '--coordinator', default=None,
+                        help='lease keys from this shared work table '
+                             '(sqlite:///path or postgresql://...) instead '
+                             'of taking split -l of -n')
+    parser.add_argument('--lease-secs', default=600.0, type=float)
+    parser.add_argument('--cascade', nargs='+', default=None,
+                        help='rerun low-confidence sections with these bigger '
+                             'models in turn, as whisper_version[:compute_type]')
+    parser.add_argument('--escalate-log-prob', default=-1.0, type=float,
+                        help='cascade: escalate below this average log prob')
+    parser.add_argument('--escalate-no-speech', default=0.6, type=float,
+                        help='cascade: escalate above this no-speech prob')
+    parser.add_argument('-B', '--batch-size', default=None, type=int,
+                        help='batch snippets across keys (default one at a time)')
+    parser.add_argument('-P', '--n-procs', default=20, type=int,
+                        help='CPU worker processes')
+    parser.add_argument('-T', '--tuned', default=None,
+                        help='JSON config from transcribe_bench.py sweep; '
+                             'overrides -P, -j, -t and -B')
+    parser.add_argument('-j', '--cpu-threads', default=None, type=int,
+                        help='CTranslate2 threads per CPU worker process '
+                             '(default: cores / processes)')
+    parser.add_argument('-p', '--prefetch', default=2, type=int,
+                        help='keys to decode ahead of the model (0 disables)')
+    parser.add_argument('--prefetch-mb', default=256, type=int,
+                        help='cap on prefetched audio per process, in MB')
+    parser.add_argument('-D', '--audio-backend', default=DEFAULT_AUDIO_BACKEND,
+                        choices=sorted(AUDIO_BACKENDS),
+                        help="decode in-process with PyAV ('av') or by "
+                             "running the ffmpeg CLI ('ffmpeg')")
+    parser.add_argument('--pcm-cache', default=None,
+                        help='keep decoded audio in this local directory, '
+                             'so later runs skip the fetch and decode')
+    parser.add_argument('--pcm-cache-gb', default=100, type=float,
+                        help='size cap on the PCM cache, in GB')
+    parser.add_argument('-V', '--vad', default=None, choices=list(VAD_METHODS),
+                        help='cut non-speech out of sections before ASR')
+    parser.add_argument('-C', '--coalesce-gap', default=None, type=float,
+                        help='transcribe sections of a key at most this many '
+                             'seconds apart as one span')
+    parser.add_argument('--timing-dir', default=None,
+                        help='write per-key/section timing records here; '
+                             'summarize with transcribe_timing.py')
 
     return parser.parse_args()
 
@@ -572,7 +2256,12 @@ def parse_args():
 def cli(prep_tasks, **kwargs):
     args = parse_args()
     args = vars(args)
-    args = kwargs.update(args)
+    kwargs.update(args)
+    args = kwargs
+
+    if args['tuned']:
+        with open(args['tuned'], 'rt') as f:
+            args.update(json.load(f))
 
     ## Set seeds
     random.seed(args['seed'])
@@ -596,30 +2285,65 @@ def cli(prep_tasks, **kwargs):
 
         'bucket': args['bucket'],
         'aws_profile': args['aws_profile'],
+        'storage': args['storage'],
 
         'whisper_version': args['whisper_version'],
         'compute_type': args['compute_type'],
+        'models': [
+            tuple(m.split(':', 1)) if ':' in m else (m, args['compute_type'])
+            for m in args['models']
+        ] if args['models'] else None,
+        'cascade': [
+            tuple(m.split(':', 1)) if ':' in m else (m, args['compute_type'])
+            for m in args['cascade']
+        ] if args['cascade'] else None,
+        'escalate_log_prob': args['escalate_log_prob'],
+        'escalate_no_speech': args['escalate_no_speech'],
+        'batch_size': args['batch_size'],
+        'prefetch': args['prefetch'],
+        'audio_backend': args['audio_backend'],
+        'pcm_cache_dir': args['pcm_cache'],
+        'pcm_cache_bytes': int(args['pcm_cache_gb'] * 2**30),
+        'prefetch_bytes': args['prefetch_mb'] * 2**20,
 
         'cache_dir': args['outdir'],
+        'cache_format': args['cache_format'],
+        'output_format': args['output_format'],
+        'timing_dir': args['timing_dir'],
+        'vad': args['vad'],
+        'coalesce_gap': args['coalesce_gap'],
     }
 
     if args['cuda']:
         params['cuda_devices'] = 'auto'
     else:
-        params['n_procs'] = 20
+        params['n_procs'] = args['n_procs']
+        params['cpu_threads'] = args['cpu_threads']
         params['cuda_devices'] = []
         params['gpu_share'] = 0
 
     tasks = prep_tasks()
 
-    keys = sorted(list(tasks.keys()))
-    splits = [
-        int(hashlib.sha256(k.encode('utf-8')).hexdigest(), 16) % args['n_splits']
-        for k in keys
-    ]
-    selected_keys = [k for k, s in zip(keys, splits) if s == args['split']]
+    if args['coordinator']:
+        if args['cuda']:
+            raise ValueError('--coordinator needs the multi-process runner')
 
-    params['tasks'] = {k: tasks[k] for k in selected_keys}
+        # every node offers all keys; the work table decides who does what
+        params['coordinator'] = args['coordinator']
+        params['lease_secs'] = args['lease_secs']
+        params['tasks'] = tasks
+    else:
+        keys = sorted(list(tasks.keys()))
+        splits = [
+            int(hashlib.sha256(k.encode('utf-8')).hexdigest(), 16) % args['n_splits']
+            for k in keys
+        ]
+        selected_keys = [k for k, s in zip(keys, splits) if s == args['split']]
+
+        if isinstance(tasks, TaskManifest):
+            params['tasks'] = tasks.subset(selected_keys)
+        else:
+            params['tasks'] = {k: tasks[k] for k in selected_keys}
 
     ## Run the job!
     return kls(**params).run()
\ No newline at end of file
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+
+# ./transcribe_bench.py compare -B 16 audio/*.raw
+# ./transcribe_bench.py sweep -r /data/audio-mirror -k tasks.manifest -o tuned.json
+#
+# Transcription benchmarks that run on CPU against local audio only:
+#  * compare: snippet-at-a-time vs batched inference on a single model,
+#    reporting throughput in audio seconds per wall-clock second;
+#  * sweep: runs MultiTranscriber over a sample of keys from a local
+#    mirror (see storage.py) for every combination of processes, threads
+#    per process, compute_type and batch size, reports real-time factor,
+#    peak RSS and per-stage times, and writes the best configuration as
+#    JSON for `cli --tuned`.
+
+import os
+import csv
+import json
+import time
+import random
+import logging
+import resource
+import argparse
+import tempfile
+import itertools as it
+import multiprocessing as mp
+from queue import Empty
+
+import numpy as np
+
+from faster_whisper import WhisperModel, BatchedInferencePipeline
+
+import transcribe as tr
+from storage import get_storage
+from task_manifest import load_tasks
+
+
+logger = logging.getLogger(__name__)
+
+
+#
+# compare
+#
+
+def sample_sections(paths, n_sections, section_len, sr=16000):
+    audios = [tr._load_audio(path, sr=sr) for path in paths]
+
+    ret = []
+    for _ in range(n_sections):
+        audio = random.choice(audios)
+        length = int(sr * random.uniform(section_len / 2, section_len * 1.5))
+        start = random.randrange(max(audio.shape[0] - length, 1))
+
+        ret += [audio[start:(start+length)]]
+
+    return ret
+
+
+def bench(fn, sections, sr=16000):
+    t0 = time.perf_counter()
+    fn(sections)
+    elapsed = time.perf_counter() - t0
+
+    audio_secs = sum(s.shape[0] for s in sections) / sr
+    return {
+        'audio_secs': audio_secs,
+        'wall_secs': elapsed,
+        'throughput': audio_secs / elapsed,
+    }
+
+
+def compare(args):
+    sections = sample_sections(args.paths, args.n_sections, args.section_len)
+
+    model = WhisperModel(
+        args.whisper_version,
+        device='cpu',
+        num_workers=1,
+        cpu_threads=args.cpu_threads,
+        compute_type=args.compute_type,
+    )
+    batched_model = BatchedInferencePipeline(model=model)
+
+    modes = {
+        'sequential': lambda secs: [tr.transcribe_audio(model, s) for s in secs],
+        'batched': lambda secs: tr.transcribe_audio_batch(
+            batched_model,
+            sorted(secs, key=lambda s: s.shape[0]),
+            batch_size=args.batch_size,
+        ),
+    }
+
+    bench(modes['sequential'], sections[:2])  # warm up
+
+    results = {name: bench(fn, sections) for name, fn in modes.items()}
+    for name, res in results.items():
+        logger.info(f"{name}: {res['audio_secs']:.1f} audio-s in "
+                    f"{res['wall_secs']:.1f} wall-s, "
+                    f"{res['throughput']:.2f} audio-s/wall-s")
+
+    speedup = results['batched']['throughput'] / results['sequential']['throughput']
+    logger.info(f'batched speedup: {speedup:.2f}x')
+
+
+#
+# sweep
+#
+
+def sample_tasks(path, n_keys, root):
+    tasks = load_tasks(path)
+
+    storage = get_storage(root)
+    keys = sorted(k for k in tasks.keys() if storage.exists(k))
+    if not keys:
+        raise ValueError(f'None of the task keys are present under {root}')
+
+    keys = random.sample(keys, min(n_keys, len(keys)))
+    return {k: tasks[k] for k in keys}
+
+
+def _run_config(config, tasks, root, whisper_version):
+    with tempfile.TemporaryDirectory() as cache_dir:
+        mt = tr.MultiTranscriber(
+            tasks=tasks,
+            n_procs=config['n_procs'],
+            cpu_threads=config['cpu_threads'],
+            cuda_devices=[],
+            gpu_share=0,
+            cache_only=True,
+            progress=False,
+
+            storage=root,
+            cache_dir=cache_dir,
+            whisper_version=whisper_version,
+            compute_type=config['compute_type'],
+            batch_size=config['batch_size'],
+        )
+
+        t0 = time.perf_counter()
+        mt.run()
+        wall = time.perf_counter() - t0
+
+    stages = {}
+    for stats in mt.worker_stats:
+        for stage, secs in stats.get('stage_times', {}).items():
+            stages[stage] = stages.get(stage, 0.0) + secs
+
+    audio = stages.pop('audio', 0.0)
+    load_secs = [s['ready'] - s['start'] for s in mt.worker_stats]
+    worker_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 2**10
+    self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+
+    return dict(
+        config,
+        audio_secs=audio,
+        wall_secs=wall,
+        rtf=wall / audio if audio > 0 else float('inf'),
+        throughput=audio / wall,
+        model_load_secs=float(np.mean(load_secs)),
+        peak_worker_rss_mb=worker_rss,
+        est_total_rss_mb=self_rss + worker_rss * config['n_procs'],
+        errors=sum('error' in s for s in mt.worker_stats),
+        **{f'{stage}_secs': secs for stage, secs in stages.items()},
+    )
+
+
+def run_config(config, tasks, root, whisper_version, queue):
+    # runs in its own process, so RUSAGE_CHILDREN only sees this config's
+    # worker processes once the pools have been joined. Always puts a
+    # result, so the sweep never waits on a config that failed.
+    try:
+        res = _run_config(config, tasks, root, whisper_version)
+    except Exception as exc:
+        logger.exception(f'config {config} failed')
+        res = dict(config, error=repr(exc))
+
+    queue.put(res)
+
+
+def wait_config(proc, queue, config, timeout=None, poll_secs=5.0):
+    # the config's result, or a failed one if its process died without
+    # putting one (e.g. OOM-killed) or ran past timeout seconds
+    t0 = time.perf_counter()
+    while True:
+        try:
+            return queue.get(timeout=poll_secs)
+        except Empty:
+            pass
+
+        if not proc.is_alive():
+            try:  # it may have put its result just before exiting
+                return queue.get(timeout=poll_secs)
+            except Empty:
+                return dict(config, error=f'process died, exit code {proc.exitcode}')
+
+        if timeout is not None and time.perf_counter() - t0 > timeout:
+            proc.terminate()
+            return dict(config, error=f'timed out after {timeout:.0f}s')
+
+
+def sweep(args):
+    tasks = sample_tasks(args.tasks, args.n_keys, args.root)
+    logger.info(f'{len(tasks)} keys, '
+                f"{sum(v['duration'].sum() for v in tasks.values()):.0f}s of audio")
+
+    configs = [
+        {'n_procs': p, 'cpu_threads': t, 'compute_type': c, 'batch_size': b}
+        for p, t, c, b in it.product(args.n_procs, args.cpu_threads,
+                                     args.compute_types, args.batch_sizes)
+        if p * t <= os.cpu_count() or args.oversubscribe
+    ]
+
+    results = []
+    for i, config in enumerate(configs):
+        logger.info(f'config {i + 1}/{len(configs)}: {config}')
+
+        queue = mp.Queue()
+        proc = mp.Process(target=run_config, args=(
+            config, tasks, args.root, args.whisper_version, queue,
+        ))
+        proc.start()
+        res = wait_config(proc, queue, config, timeout=args.config_timeout)
+        proc.join()
+
+        results += [res]
+        if 'error' in res:
+            logger.error(f"config failed: {res['error']}")
+            continue
+
+        logger.info(f"rtf {res['rtf']:.3f}, {res['throughput']:.2f} audio-s/wall-s, "
+                    f"peak worker RSS {res['peak_worker_rss_mb']:.0f} MB, "
+                    f"est. total RSS {res['est_total_rss_mb']:.0f} MB, "
+                    + ', '.join(f"{stage} {res.get(f'{stage}_secs', 0):.1f}s"
+                                for stage in ('fetch', 'decode', 'wait', 'asr',
+                                              'serialize', 'write')))
+
+    if args.out_csv:
+        fields = sorted(set().union(*[r.keys() for r in results]))
+        with open(args.out_csv, 'wt') as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(results)
+
+    ok = [
+        r for r in results
+        if 'error' not in r and not r['errors'] and (
+            args.max_rss_gb is None or
+            r['est_total_rss_mb'] <= args.max_rss_gb * 2**10
+        )
+    ]
+    if not ok:
+        raise RuntimeError('No configuration completed within the limits')
+
+    best = min(ok, key=lambda r: r['rtf'])
+    best = {k: best[k] for k in ('n_procs', 'cpu_threads', 'compute_type', 'batch_size')}
+    logger.info(f'best: {best}')
+
+    print(json.dumps(best))
+    if args.out:
+        with open(args.out, 'wt') as f:
+            json.dump(best, f)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-w', '--whisper-version', default='base')
+    parser.add_argument('-s', '--seed', default=2969591811, type=int)
+
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    cmp = subparsers.add_parser('compare')
+    cmp.add_argument('paths', nargs='+', help='local audio files')
+    cmp.add_argument('-t', '--compute-type', default='int8')
+    cmp.add_argument('-B', '--batch-size', default=16, type=int)
+    cmp.add_argument('-j', '--cpu-threads', default=0, type=int)
+    cmp.add_argument('-n', '--n-sections', default=64, type=int)
+    cmp.add_argument('-d', '--section-len', default=20.0, type=float,
+                     help='mean section length in seconds')
+
+    swp = subparsers.add_parser('sweep')
+    swp.add_argument('-r', '--root', required=True,
+                     help='local audio mirror root')
+    swp.add_argument('-k', '--tasks', required=True,
+                     help='task manifest (see task_manifest.py) or pickled '
+                          'tasks dict, as made by prep_tasks()')
+    swp.add_argument('-n', '--n-keys', default=20, type=int)
+    swp.add_argument('-P', '--n-procs', nargs='+', type=int,
+                     default=[1, 2, 4, 8, 16])
+    swp.add_argument('-j', '--cpu-threads', nargs='+', type=int,
+                     default=[1, 2, 4])
+    swp.add_argument('-t', '--compute-types', nargs='+',
+                     default=['int8', 'int8_float32', 'float32'])
+    swp.add_argument('-B', '--batch-sizes', nargs='+', type=int,
+                     default=[0, 8, 16])
+    swp.add_argument('--oversubscribe', action='store_true',
+                     help='also try procs x threads > cores')
+    swp.add_argument('--max-rss-gb', default=None, type=float)
+    swp.add_argument('--config-timeout', default=None, type=float,
+                     help='give up on a configuration after this many seconds')
+    swp.add_argument('-o', '--out', default=None, help='best config JSON')
+    swp.add_argument('--out-csv', default=None, help='all results as CSV')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    fmt = '%(asctime)s : %(levelname)s : %(message)s'
+    logging.basicConfig(format=fmt, level=logging.INFO)
+
+    args = parse_args()
+
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+
+    if args.command == 'compare':
+        compare(args)
+    else:
+        sweep(args)
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+
+# ./transcribe_timing.py whisper-timing/
+#
+# Per-key and per-section timing records for transcription runs. Every
+# Transcriber given a timing_dir appends JSONL records to its own file
+# there (one per process, so no locking across workers):
+#  * 'key' records, one per key loaded: fetch (storage reads and probes),
+#    decode (ffmpeg), vad, wait (time the model sat waiting for this key's
+#    audio), decode mode and the key's section count and audio seconds;
+#  * 'section' records, one per snippet written: asr, serialize and write
+#    seconds (a batch's time shared out by audio length), audio seconds and
+#    seconds cut out by VAD.
+# Both carry the model settings, host, pid and a wall-clock timestamp. Run
+# as a script, summarizes the records: throughput, RTF percentiles and the
+# bottleneck stage.
+
+import os
+import json
+import time
+import glob
+import uuid
+import socket
+import logging
+import argparse
+import threading
+
+import numpy as np
+import pandas as pd
+
+
+logger = logging.getLogger(__name__)
+
+
+LOAD_STAGES = ['fetch', 'decode', 'vad']
+MODEL_STAGES = ['wait', 'asr', 'serialize', 'write']
+
+
+class TimingLog:
+    def __init__(self, log_dir, context=None):
+        super().__init__()
+
+        self.log_dir = log_dir
+        self.context = dict(context or {}, host=socket.gethostname())
+        os.makedirs(self.log_dir, exist_ok=True)
+
+        # opened on first write, so each (possibly forked) process gets its own
+        self._lock = threading.Lock()
+        self._file = None
+        self._pid = None
+
+    def _open(self):
+        name = f"{self.context['host']}-{os.getpid()}-{uuid.uuid4().hex[:8]}.jsonl"
+        self._file = open(os.path.join(self.log_dir, name), 'at', buffering=1)
+        self._pid = os.getpid()
+
+    def write(self, record):
+        record = dict(self.context, pid=os.getpid(), time=time.time(), **record)
+        line = json.dumps(record) + '\n'
+
+        with self._lock:
+            if self._file is None or self._pid != os.getpid():
+                self._open()
+
+            self._file.write(line)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None and self._pid == os.getpid():
+                self._file.close()
+            self._file = None
+
+
+def read_records(log_dir):
+    records = []
+    for path in sorted(glob.glob(os.path.join(log_dir, '*.jsonl'))):
+        with open(path, 'rt') as f:
+            for line in f:
+                try:
+                    records += [json.loads(line)]
+                except json.JSONDecodeError:
+                    # a process killed mid-write leaves a partial last line
+                    logger.warning(f'Skipping malformed record in {path}')
+
+    return pd.DataFrame(records)
+
+
+def _percentiles(values, qs=(50, 90, 99)):
+    values = np.asarray(values, dtype=float)
+    values = values[np.isfinite(values)]
+    if values.size == 0:
+        return {f'p{q}': float('nan') for q in qs}
+
+    return {f'p{q}': float(np.percentile(values, q)) for q in qs}
+
+
+def summarize(df):
+    # records from before a field existed count it as zero
+    df = df.reindex(columns=df.columns.union(
+        LOAD_STAGES + MODEL_STAGES + ['vad_skipped']
+    ))
+    df = df.fillna({c: 0.0 for c in LOAD_STAGES + MODEL_STAGES + ['vad_skipped']})
+
+    keys = df.loc[df['type'] == 'key', :]
+    sections = df.loc[df['type'] == 'section', :]
+
+    totals = {
+        stage: float(frame[stage].sum())
+        for frame, stages in [(keys, LOAD_STAGES), (sections, MODEL_STAGES[1:])]
+        for stage in stages
+    }
+    totals['wait'] = float(keys['wait'].sum())
+
+    audio = float(sections['audio_secs'].sum())
+    wall = float(df['time'].max() - df['time'].min()) if df.shape[0] > 1 else 0.0
+
+    # per-key RTF counts every stage the key went through, over its audio
+    per_key = sections.groupby('key')[['audio_secs'] + MODEL_STAGES[1:]].sum()
+    per_key = per_key.join(keys.groupby('key')[LOAD_STAGES].sum(), how='left')
+    per_key = per_key.fillna(0.0)
+    key_rtf = per_key[LOAD_STAGES + MODEL_STAGES[1:]].sum(axis=1) / per_key['audio_secs']
+
+    # With prefetching, loading overlaps the model, so it's only the
+    # bottleneck if the model spends more time waiting on it than working
+    busy = sum(totals[s] for s in MODEL_STAGES[1:])
+    if totals['wait'] > busy:
+        bottleneck = max(LOAD_STAGES, key=lambda s: totals[s])
+    else:
+        bottleneck = max(MODEL_STAGES[1:], key=lambda s: totals[s])
+
+    return {
+        'n_keys': int(per_key.shape[0]),
+        'n_sections': int(sections.shape[0]),
+        'n_processes': int(df[['host', 'pid']].drop_duplicates().shape[0]),
+        'audio_secs': audio,
+        'vad_skipped_secs': float(sections['vad_skipped'].sum()),
+        'wall_secs': wall,
+        'throughput': audio / wall if wall > 0 else float('nan'),
+        'stage_secs': totals,
+        'key_rtf': _percentiles(key_rtf),
+        'asr_rtf': _percentiles(sections['asr'] / sections['audio_secs']),
+        'bottleneck': bottleneck,
+    }
+
+
+def report(summary, label=None):
+    totals = summary['stage_secs']
+    grand = sum(totals.values())
+
+    lines = [
+        f"{label}:" if label else None,
+        f"{summary['n_keys']} keys, {summary['n_sections']} sections, "
+        f"{summary['n_processes']} processes",
+        f"{summary['audio_secs']:.0f}s audio in {summary['wall_secs']:.0f}s wall, "
+        f"{summary['throughput']:.2f} audio-s/wall-s",
+        f"{summary['vad_skipped_secs']:.0f}s "
+        f"({summary['vad_skipped_secs'] / summary['audio_secs']:.1%}) skipped by VAD"
+        if summary['vad_skipped_secs'] > 0 else None,
+        'key RTF ' + ', '.join(f'{k} {v:.3f}' for k, v in summary['key_rtf'].items()),
+        'ASR RTF ' + ', '.join(f'{k} {v:.3f}' for k, v in summary['asr_rtf'].items()),
+    ]
+    lines += [
+        f'  {stage:<10} {totals[stage]:>10.1f}s '
+        f'{totals[stage] / grand if grand > 0 else 0.0:>6.1%}'
+        for stage in LOAD_STAGES + MODEL_STAGES
+    ]
+    lines += [f"bottleneck: {summary['bottleneck']}"]
+
+    return '\n'.join(line for line in lines if line is not None)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('log_dir', help='timing directory of a transcription run')
+    parser.add_argument('-g', '--group-by', nargs='*',
+                        default=['whisper_version', 'compute_type',
+                                 'batch_size', 'vad_method'],
+                        help='record fields to summarize separately')
+    parser.add_argument('-j', '--json', action='store_true',
+                        help='print the summaries as JSON')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    fmt = '%(asctime)s : %(levelname)s : %(message)s'
+    logging.basicConfig(format=fmt, level=logging.INFO)
+
+    args = parse_args()
+
+    df = read_records(args.log_dir)
+    if df.shape[0] == 0:
+        raise SystemExit(f'No timing records in {args.log_dir}')
+
+    by = [c for c in args.group_by if c in df.columns]
+    if by:
+        # JSON nulls make numeric columns float; label them as written
+        def label(v):
+            if pd.isna(v):
+                return 'none'
+            return int(v) if isinstance(v, float) and v.is_integer() else v
+
+        groups = df.assign(**{c: df[c].map(label) for c in by}).groupby(by)
+        groups = [(dict(zip(by, k if isinstance(k, tuple) else (k,))), g)
+                  for k, g in groups]
+    else:
+        groups = [({}, df)]
+
+    summaries = [dict(labels, **summarize(g)) for labels, g in groups]
+
+    if args.json:
+        print(json.dumps(summaries, indent=2))
+    else:
+        print('\n\n'.join(
+            report(s, ', '.join(f'{c}={s[c]}' for c in by) or None)
+            for s in summaries
+        ))
@@ -0,0 +1,471 @@
+#!/usr/bin/env python3
+
+# ./transcript_cache.py whisper-cache/ whisper-cache-segments/
+#
+# Storage for Whisper output, keyed by audio key and snippet id. Two
+# layouts are supported:
+#  * 'dir': the original one, a directory per audio key holding one
+#    <id>.json file per snippet;
+#  * 'segments': append-only gzip JSONL segment files plus an SQLite
+#    manifest indexing every snippet. Each write appends one gzip member
+#    holding a key's snippets, so bulk reads are sequential and no
+#    per-snippet files or directories are created.
+# Either can instead write output_format='columnar' (see
+# transcript_format.py): <id>.wsc files, or columnar segment members.
+# Reads handle both encodings, so a cache can hold a mix of them. Run as a
+# script, copies a cache into a 'segments' one (by default), in either
+# encoding.
+
+import os
+import json
+import gzip
+import uuid
+import socket
+import sqlite3
+import logging
+import argparse
+import threading
+import contextlib
+from abc import ABC, abstractmethod
+
+from tqdm import tqdm
+
+import transcript_format
+
+
+logger = logging.getLogger(__name__)
+
+
+class TranscriptCache(ABC):
+    cache_format = None
+
+    def __init__(self, cache_dir, output_format='json'):
+        super().__init__()
+
+        if output_format not in transcript_format.OUTPUT_FORMATS:
+            raise ValueError(f'Invalid output_format {output_format}')
+
+        self.cache_dir = cache_dir
+        self.output_format = output_format
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @abstractmethod
+    def keys(self):
+        raise NotImplementedError()
+
+    @abstractmethod
+    def is_cached(self, key):
+        # whether any of the key's snippets have been written
+        raise NotImplementedError()
+
+    @abstractmethod
+    def cached_ids(self, key):
+        # ids (as strings) of the key's snippets that have been written
+        raise NotImplementedError()
+
+    @abstractmethod
+    def cached_sections(self):
+        # {key: cached_ids(key)} for every key, in one pass
+        raise NotImplementedError()
+
+    def write(self, key, items):
+        self.write_encoded(key, self.encode(key, items))
+
+    @abstractmethod
+    def encode(self, key, items):
+        # serialize items for write_encoded, without touching storage
+        raise NotImplementedError()
+
+    @abstractmethod
+    def write_encoded(self, key, data):
+        raise NotImplementedError()
+
+    @abstractmethod
+    def read(self, key):
+        raise NotImplementedError()
+
+    @abstractmethod
+    def items(self):
+        # (key, item) for every cached snippet, in storage order
+        raise NotImplementedError()
+
+
+class DirectoryCache(TranscriptCache):
+    cache_format = 'dir'
+    extensions = {'json': '.json', 'columnar': '.wsc'}
+
+    def keys(self):
+        return {
+            os.path.relpath(root, self.cache_dir)
+            for root, dirs, _ in os.walk(self.cache_dir)
+            if not dirs and root != self.cache_dir
+        }
+
+    def is_cached(self, key):
+        return os.path.exists(os.path.join(self.cache_dir, key))
+
+    @classmethod
+    def _id(cls, file):
+        # the snippet id if file holds one, else None; in-progress writes
+        # are dotfiles ending in .tmp, so never match
+        for ext in cls.extensions.values():
+            if file.endswith(ext):
+                return file[:-len(ext)]
+
+        return None
+
+    @classmethod
+    def _ids(cls, files):
+        return {cls._id(f) for f in files} - {None}
+
+    @staticmethod
+    def _read_file(path):
+        with open(path, 'rb') as f:
+            data = f.read()
+
+        if transcript_format.is_columnar(data):
+            return transcript_format.decode(data)[1][0]
+
+        return json.loads(data.decode('utf-8'))
+
+    def cached_ids(self, key):
+        key_path = os.path.join(self.cache_dir, key)
+        if not os.path.isdir(key_path):
+            return set()
+
+        return self._ids(os.listdir(key_path))
+
+    def cached_sections(self):
+        return {
+            os.path.relpath(root, self.cache_dir): self._ids(files)
+            for root, dirs, files in os.walk(self.cache_dir)
+            if not dirs and root != self.cache_dir
+        }
+
+    def encode(self, key, items):
+        if self.output_format == 'columnar':
+            return [(item['id'], transcript_format.encode(key, [item])) for item in items]
+
+        return [(item['id'], json.dumps(item).encode('utf-8')) for item in items]
+
+    def write_encoded(self, key, data):
+        key_path = os.path.join(self.cache_dir, key)
+        os.makedirs(key_path, exist_ok=True)
+
+        ext = self.extensions[self.output_format]
+        for id, blob in data:
+            item_path = os.path.join(key_path, f"{id}{ext}")
+            tmp_path = os.path.join(key_path, f".{id}{ext}.tmp")
+
+            # a snippet's file appears complete or not at all
+            with open(tmp_path, 'wb') as f:
+                f.write(blob)
+            os.replace(tmp_path, item_path)
+
+            # and only in the latest encoding
+            for other in self.extensions.values():
+                if other != ext:
+                    with contextlib.suppress(FileNotFoundError):
+                        os.remove(os.path.join(key_path, f"{id}{other}"))
+
+    def read(self, key):
+        key_path = os.path.join(self.cache_dir, key)
+
+        return [
+            self._read_file(os.path.join(key_path, obj))
+            for obj in os.listdir(key_path)
+            if self._id(obj) is not None
+        ]
+
+    def items(self):
+        # unreadable files (e.g. truncated by the old non-atomic writer)
+        # are logged and skipped, so one doesn't end a full scan
+        for root, dirs, files in os.walk(self.cache_dir):
+            key = os.path.relpath(root, self.cache_dir)
+
+            for file in files:
+                if self._id(file) is None:
+                    continue
+
+                try:
+                    item = self._read_file(os.path.join(root, file))
+                except Exception:
+                    logger.exception(f'Failed to read {file} of {key}')
+                    continue
+
+                yield key, item
+
+
+class SegmentCache(TranscriptCache):
+    cache_format = 'segments'
+    manifest_name = 'manifest.sqlite'
+
+    schema = [
+        '''
+        create table if not exists segments (
+            segment_id integer primary key,
+            path text not null unique
+        )
+        ''',
+        '''
+        create table if not exists snippets (
+            key text not null,
+            id text not null,
+            segment_id integer not null,
+            offset integer not null,
+            length integer not null,
+            primary key (key, id)
+        ) without rowid
+        ''',
+        'create index if not exists snippets_segment on snippets (segment_id, offset)',
+    ]
+
+    def __init__(self, cache_dir, max_segment_bytes=256 * 2**20, **kwargs):
+        super().__init__(cache_dir, **kwargs)
+
+        self.max_segment_bytes = max_segment_bytes
+        os.makedirs(os.path.join(self.cache_dir, 'segments'), exist_ok=True)
+
+        # one connection per instance, shared by its threads under a lock;
+        # WAL lets many worker processes append concurrently
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(
+            os.path.join(self.cache_dir, self.manifest_name),
+            timeout=600,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        self.conn.execute('pragma journal_mode=wal')
+        self.conn.execute('pragma synchronous=normal')
+        for stmt in self.schema:
+            self.conn.execute(stmt)
+
+        self._segment = None
+
+    @classmethod
+    def exists(cls, cache_dir):
+        return os.path.exists(os.path.join(cache_dir, cls.manifest_name))
+
+    def _open_segment(self):
+        # each writer appends only to segments it created itself
+        name = f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}.jsonl.gz'
+        path = os.path.join('segments', name)
+
+        cur = self.conn.execute('insert into segments (path) values (?)', (path,))
+        self._segment = (cur.lastrowid, open(os.path.join(self.cache_dir, path), 'ab'))
+
+    def _append(self, data):
+        if self._segment is None or self._segment[1].tell() >= self.max_segment_bytes:
+            if self._segment is not None:
+                self._segment[1].close()
+            self._open_segment()
+
+        segment_id, f = self._segment
+
+        offset = f.tell()
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+        return segment_id, offset
+
+    def keys(self):
+        with self._lock:
+            return {row[0] for row in self.conn.execute('select distinct key from snippets')}
+
+    def is_cached(self, key):
+        with self._lock:
+            row = self.conn.execute(
+                'select 1 from snippets where key = ? limit 1', (key,)
+            ).fetchone()
+
+        return row is not None
+
+    def cached_ids(self, key):
+        with self._lock:
+            return {
+                row[0] for row in
+                self.conn.execute('select id from snippets where key = ?', (key,))
+            }
+
+    def cached_sections(self):
+        ret = {}
+        with self._lock:
+            for key, id in self.conn.execute('select key, id from snippets'):
+                ret.setdefault(key, set()).add(id)
+
+        return ret
+
+    def encode(self, key, items):
+        ids = [str(item['id']) for item in items]
+        if self.output_format == 'columnar':
+            return ids, transcript_format.encode(key, items)
+
+        lines = ''.join(json.dumps([key, item]) + '\n' for item in items)
+        return ids, gzip.compress(lines.encode('utf-8'))
+
+    def write_encoded(self, key, data):
+        ids, data = data
+        if not ids:
+            return
+
+        # the index rows go in only after the data is on disk, so a crash
+        # leaves at most some unreferenced bytes at the end of a segment
+        with self._lock:
+            segment_id, offset = self._append(data)
+
+            rows = [(key, id, segment_id, offset, len(data)) for id in ids]
+            with self._transaction():
+                self.conn.executemany(
+                    'insert or replace into snippets values (?, ?, ?, ?, ?)',
+                    rows,
+                )
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        # the connection is in autocommit mode, so group statements by hand
+        self.conn.execute('begin immediate')
+        try:
+            yield
+        except BaseException:
+            self.conn.execute('rollback')
+            raise
+        else:
+            self.conn.execute('commit')
+
+    def _read_member(self, f, offset, length):
+        f.seek(offset)
+        data = f.read(length)
+
+        if transcript_format.is_columnar(data):
+            key, items = transcript_format.decode(data)
+            yield from ([key, item] for item in items)
+        else:
+            for line in gzip.decompress(data).decode('utf-8').splitlines():
+                yield json.loads(line)
+
+    def read(self, key):
+        with self._lock:
+            rows = self.conn.execute('''
+                select g.path, s.offset, s.length, s.id
+                from snippets s join segments g using (segment_id)
+                where s.key = ?
+            ''', (key,)).fetchall()
+
+        members = {}
+        for path, offset, length, id in rows:
+            members.setdefault((path, offset, length), set()).add(id)
+
+        ret = []
+        for (path, offset, length), ids in members.items():
+            with open(os.path.join(self.cache_dir, path), 'rb') as f:
+                ret += [
+                    item for k, item in self._read_member(f, offset, length)
+                    if k == key and str(item['id']) in ids
+                ]
+
+        return ret
+
+    def items(self):
+        # Streams the index in segment order on its own connection, so a
+        # writer in this process isn't blocked meanwhile. Snippets rewritten
+        # later (e.g. on a rerun) are only yielded from their newest copy.
+        conn = sqlite3.connect(os.path.join(self.cache_dir, self.manifest_name),
+                               timeout=600)
+        rows = conn.execute('''
+            select g.path, s.offset, s.length, s.key, s.id
+            from snippets s join segments g using (segment_id)
+            order by s.segment_id, s.offset
+        ''')
+
+        f, current, member, wanted = None, None, None, set()
+
+        def flush():
+            if member is not None:
+                yield from (
+                    (k, item) for k, item in self._read_member(f, *member[1:])
+                    if (k, str(item['id'])) in wanted
+                )
+
+        try:
+            for path, offset, length, key, id in rows:
+                if member != (path, offset, length):
+                    yield from flush()
+
+                    if path != current:
+                        if f is not None:
+                            f.close()
+                        f, current = open(os.path.join(self.cache_dir, path), 'rb'), path
+
+                    member, wanted = (path, offset, length), set()
+
+                wanted.add((key, id))
+
+            yield from flush()
+        finally:
+            if f is not None:
+                f.close()
+            conn.close()
+
+    def close(self):
+        with self._lock:
+            if self._segment is not None:
+                self._segment[1].close()
+                self._segment = None
+
+            self.conn.close()
+
+
+def open_cache(cache_dir, cache_format=None, output_format='json'):
+    # an existing manifest wins; otherwise the original layout by default
+    if cache_format is None:
+        cache_format = 'segments' if SegmentCache.exists(cache_dir) else 'dir'
+
+    if cache_format == 'segments':
+        return SegmentCache(cache_dir, output_format=output_format)
+    elif cache_format == 'dir':
+        return DirectoryCache(cache_dir, output_format=output_format)
+    else:
+        raise ValueError(f'Invalid cache_format {cache_format}')
+
+
+def migrate(src_dir, dst_dir, cache_format='segments', output_format='json',
+            progress=True):
+    src = open_cache(src_dir)
+    dst = open_cache(dst_dir, cache_format, output_format)
+
+    try:
+        done = dst.keys()
+
+        for key in tqdm(sorted(src.keys() - done), desc='Migrate', unit='key',
+                        disable=(not progress)):
+            try:
+                dst.write(key, src.read(key))
+            except Exception as exc:
+                logger.exception(f'Failed to migrate {key}')
+    finally:
+        for cache in (src, dst):
+            if isinstance(cache, SegmentCache):
+                cache.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('src', help='existing cache directory')
+    parser.add_argument('dst', help='new cache directory')
+    parser.add_argument('-f', '--cache-format', default='segments',
+                        choices=['dir', 'segments'], help='layout to write')
+    parser.add_argument('-O', '--output-format', default='json',
+                        choices=sorted(transcript_format.OUTPUT_FORMATS),
+                        help='encoding to write')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    fmt = '%(asctime)s : %(levelname)s : %(message)s'
+    logging.basicConfig(format=fmt, level=logging.INFO)
+
+    args = parse_args()
+    migrate(args.src, args.dst, args.cache_format, args.output_format)
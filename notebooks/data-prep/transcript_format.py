@@ -0,0 +1,175 @@
+# A compact binary encoding of a key's Whisper output, as an alternative
+# to one JSON document per snippet. Segment and word fields are stored as
+# flat arrays (float32 where that round-trips exactly, else float64),
+# strings as indices into one shared string table, and anything else
+# (None, nested options) as JSON in that table, so values repeated across
+# snippets are stored once; the whole is zlib-compressed. It
+# decodes to exactly the items it was made from, so caches can hold
+# either encoding and readers never need to know which; to convert a
+# cache, see transcript_cache.py.
+
+import json
+import zlib
+import struct
+import itertools as it
+
+import numpy as np
+
+
+MAGIC = b'WSC1'
+OUTPUT_FORMATS = {'json', 'columnar'}
+
+
+def is_columnar(data):
+    return data[:len(MAGIC)] == MAGIC
+
+
+def _column(values, strings):
+    # (kind, array) if every value has one type that fits an array
+    if all(isinstance(v, float) for v in values):
+        arr = np.array(values, dtype=np.float64)
+        if np.array_equal(arr.astype(np.float32).astype(np.float64), arr,
+                          equal_nan=True):
+            arr = arr.astype(np.float32)
+        return 'f', arr
+    if all(isinstance(v, int) and not isinstance(v, bool) for v in values):
+        return 'i', np.array(values, dtype=np.int64)
+    if all(isinstance(v, str) for v in values):
+        return 's', np.array([strings.setdefault(v, len(strings)) for v in values],
+                             dtype=np.uint32)
+
+    return None, None
+
+
+def _encode_table(rows, strings, nested=None):
+    # Columns for the fields every row has with one type; anything else
+    # (missing fields, None, nested values) goes to per-row extras, as
+    # string table indices of the values' JSON. The nested field's list
+    # lengths are a column too, -1 if absent.
+    fields = list(dict.fromkeys(f for row in rows for f in row if f != nested))
+
+    columns, extras = {}, [{} for _ in rows]
+    for field in fields:
+        kind, arr = None, None
+        if all(field in row for row in rows):
+            kind, arr = _column([row[field] for row in rows], strings)
+
+        if kind is None:
+            for extra, row in zip(extras, rows):
+                if field in row:
+                    extra[field] = strings.setdefault(json.dumps(row[field]),
+                                                      len(strings))
+        else:
+            columns[field] = (kind, arr)
+
+    counts = None
+    if nested is not None:
+        counts = np.array([len(row[nested]) if nested in row else -1 for row in rows],
+                          dtype=np.int64)
+
+    return columns, extras if any(extras) else None, counts
+
+
+def _decode_table(n, columns, extras, strings):
+    rows = [{} for _ in range(n)]
+    for field, (kind, arr) in columns.items():
+        if kind == 's':
+            values = [strings[i] for i in arr.tolist()]
+        elif kind == 'i':
+            values = arr.tolist()
+        else:
+            values = arr.astype(np.float64).tolist()
+
+        for row, value in zip(rows, values):
+            row[field] = value
+
+    for row, extra in zip(rows, extras or [{}] * n):
+        row.update({f: json.loads(strings[i]) for f, i in extra.items()})
+
+    return rows
+
+
+def encode(key, items):
+    # items: a key's snippets, as written to the JSON cache
+    strings = {}
+
+    segments = [s for item in items for s in item.get('segments', [])]
+    words = [w for s in segments for w in s.get('words', [])]
+
+    tables = {
+        'snippets': _encode_table(items, strings, nested='segments'),
+        'segments': _encode_table(segments, strings, nested='words'),
+        'words': _encode_table(words, strings),
+    }
+
+    arrays = [('n_segments', tables['snippets'][2]), ('n_words', tables['segments'][2])]
+    arrays += [
+        (f'{table}.{f}', arr)
+        for table, (columns, _, _) in tables.items()
+        for f, (_, arr) in columns.items()
+    ]
+
+    table = [s.encode('utf-8') for s in strings]
+    arrays += [
+        ('strings', np.frombuffer(b''.join(table), dtype=np.uint8)),
+        ('string_ends', np.cumsum([len(s) for s in table], dtype=np.int64)),
+    ]
+
+    header = json.dumps({
+        'key': key,
+        'columns': {
+            table: {f: kind for f, (kind, _) in columns.items()}
+            for table, (columns, _, _) in tables.items()
+        },
+        'extras': {table: extras for table, (_, extras, _) in tables.items()},
+        'arrays': [[name, arr.dtype.str, arr.shape[0]] for name, arr in arrays],
+    }).encode('utf-8')
+
+    body = b''.join(
+        [struct.pack('<I', len(header)), header]
+        + [np.ascontiguousarray(arr).tobytes() for _, arr in arrays]
+    )
+
+    return MAGIC + zlib.compress(body)
+
+
+def decode(data):
+    # -> (key, items), the inverse of encode()
+    if not is_columnar(data):
+        raise ValueError('Not columnar transcript data')
+
+    body = memoryview(zlib.decompress(data[len(MAGIC):]))
+    (header_len,) = struct.unpack('<I', body[:4])
+    header = json.loads(bytes(body[4:(4 + header_len)]).decode('utf-8'))
+
+    arrays, pos = {}, 4 + header_len
+    for name, dtype, n in header['arrays']:
+        dtype = np.dtype(dtype)
+        arrays[name] = np.frombuffer(body, dtype=dtype, count=n, offset=pos)
+        pos += n * dtype.itemsize
+
+    blob, ends = arrays['strings'].tobytes(), arrays['string_ends'].tolist()
+    strings = [blob[s:e].decode('utf-8') for s, e in zip([0] + ends[:-1], ends)]
+
+    def table(name, n):
+        columns = {
+            f: (kind, arrays[f'{name}.{f}'])
+            for f, kind in header['columns'][name].items()
+        }
+        return _decode_table(n, columns, header['extras'][name], strings)
+
+    def nest(rows, field, children, counts):
+        children = iter(children)
+        for row, n in zip(rows, counts.tolist()):
+            if n >= 0:
+                row[field] = list(it.islice(children, n))
+
+    n_segments, n_words = arrays['n_segments'], arrays['n_words']
+    items = table('snippets', n_segments.shape[0])
+    segments = table('segments', n_words.shape[0])
+    words = table('words', int(n_words.clip(0).sum()))
+
+    nest(segments, 'words', words, n_words)
+    nest(items, 'segments', segments, n_segments)
+
+    return header['key'], items
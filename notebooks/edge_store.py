@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+
+# ./edge_store.py auto-sample.csv.gz auto-sample-sim-edges/ auto-sample-sim-edges.store
+#
+# Similarity edges as int32 node indices (rows of the snippet data, whose
+# ids are stored once in the store) and float32 or float16 sims, in .npy
+# column chunks partitioned by (year, kind), with a JSON manifest of the
+# partitions and each chunk's sim range. A partition's edges are sorted by
+# sim, so reading with a threshold memory-maps and reads only the chunks
+# (and the part of one chunk) at or above it. Run as a script, converts a
+# directory of the gzipped edge CSVs 5b used to write.
+
+import os
+import gzip
+import json
+import shutil
+import logging
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from tqdm import tqdm
+
+
+logger = logging.getLogger(__name__)
+
+
+class EdgeStore:
+    columns = ['source', 'target', 'sim']
+
+    def __init__(self, path, manifest, nodes):
+        super().__init__()
+
+        self.path = path
+        self.manifest = manifest
+        self.nodes = nodes
+
+    @classmethod
+    def create(cls, path, nodes, sim_dtype='float32', chunk_size=2**22):
+        # nodes: the snippet ids; edges refer to them by position
+        nodes = np.asarray(nodes)
+        if nodes.dtype == object:
+            nodes = nodes.astype(str)  # object arrays can't be mapped
+
+        if nodes.shape[0] > np.iinfo(np.int32).max:
+            raise ValueError('Too many nodes for int32 indices')
+
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, 'nodes.npy'), nodes)
+
+        store = cls(path, {
+            'sim_dtype': np.dtype(sim_dtype).name,
+            'chunk_size': chunk_size,
+            'partitions': [],
+        }, nodes)
+        store._write_manifest()
+
+        return store
+
+    @classmethod
+    def open(cls, path, mmap=True):
+        with open(os.path.join(path, 'manifest.json'), 'rt') as f:
+            manifest = json.load(f)
+
+        nodes = np.load(os.path.join(path, 'nodes.npy'),
+                        mmap_mode='r' if mmap else None)
+
+        return cls(path, manifest, nodes)
+
+    @staticmethod
+    def exists(path):
+        return os.path.exists(os.path.join(path, 'manifest.json'))
+
+    def _write_manifest(self):
+        # renamed in, so readers see the old manifest or the new one
+        tmp_path = os.path.join(self.path, 'manifest.json.tmp')
+        with open(tmp_path, 'wt') as f:
+            json.dump(self.manifest, f, indent=1)
+        os.replace(tmp_path, os.path.join(self.path, 'manifest.json'))
+
+    @staticmethod
+    def _name(year, kind):
+        return f'{year}-{kind}'
+
+    def partitions(self):
+        return [(p['year'], p['kind']) for p in self.manifest['partitions']]
+
+    def has_partition(self, year, kind):
+        return (int(year), str(kind)) in self.partitions()
+
+    def write_partition(self, year, kind, source, target, sim, **meta):
+        # source, target: node indices; meta (e.g. the threshold the edges
+        # were cut at) is kept in the manifest. Replaces any existing
+        # partition for (year, kind).
+        year, kind = int(year), str(kind)
+        name = self._name(year, kind)
+
+        order = np.argsort(np.asarray(sim, dtype=np.float64), kind='stable')
+        values = {
+            'source': np.asarray(source)[order].astype(np.int32),
+            'target': np.asarray(target)[order].astype(np.int32),
+            'sim': np.asarray(sim)[order].astype(self.manifest['sim_dtype']),
+        }
+
+        # written next to the target and renamed in, like the manifest
+        tmp_path = os.path.join(self.path, name + '.tmp')
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+
+        chunks, chunk_size = [], self.manifest['chunk_size']
+        for i, c in enumerate(range(0, order.shape[0], chunk_size)):
+            for col, arr in values.items():
+                np.save(os.path.join(tmp_path, f'{i:05d}.{col}.npy'),
+                        arr[c:(c+chunk_size)])
+
+            sims = values['sim'][c:(c+chunk_size)]
+            chunks += [{
+                'n': int(sims.shape[0]),
+                'min_sim': float(sims[0]),
+                'max_sim': float(sims[-1]),
+            }]
+
+        shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+        os.replace(tmp_path, os.path.join(self.path, name))
+
+        self.manifest['partitions'] = [
+            p for p in self.manifest['partitions']
+            if (p['year'], p['kind']) != (year, kind)
+        ] + [dict(meta, year=year, kind=kind, n_edges=int(order.shape[0]),
+                  chunks=chunks)]
+        self._write_manifest()
+
+    def _read_partition(self, part, min_sim=None, mmap=True):
+        # the partition's columns, cut at min_sim; chunks wholly below it
+        # aren't opened and only one chunk is cut
+        name = self._name(part['year'], part['kind'])
+
+        ret = {col: [] for col in self.columns}
+        for i, chunk in enumerate(part['chunks']):
+            if min_sim is not None and chunk['max_sim'] < min_sim:
+                continue
+
+            arrs = {
+                col: np.load(os.path.join(self.path, name, f'{i:05d}.{col}.npy'),
+                             mmap_mode='r' if mmap else None)
+                for col in self.columns
+            }
+
+            start = 0
+            if min_sim is not None and chunk['min_sim'] < min_sim:
+                # a binary search on the map, comparing as float64
+                start = int(np.searchsorted(arrs['sim'], float(min_sim)))
+
+            for col in self.columns:
+                ret[col] += [arrs[col][start:]]
+
+        return {
+            col: np.concatenate(v) if v else np.zeros(0, dtype=dtype)
+            for (col, v), dtype in zip(
+                ret.items(), [np.int32, np.int32, self.manifest['sim_dtype']]
+            )
+        }
+
+    def read(self, years=None, kinds=None, min_sim=None, ids=True, mmap=True):
+        # edges as a DataFrame with year and kind columns. min_sim is one
+        # threshold for all partitions or {(year, kind): threshold}; edges
+        # with sim >= it are kept. With ids, source and target are the
+        # snippet ids, else node indices.
+        frames = []
+        for part in self.manifest['partitions']:
+            year, kind = part['year'], part['kind']
+            if years is not None and year not in years:
+                continue
+            if kinds is not None and kind not in kinds:
+                continue
+
+            thresh = min_sim
+            if isinstance(min_sim, dict):
+                thresh = min_sim[(year, kind)]
+
+            cols = self._read_partition(part, thresh, mmap=mmap)
+            if ids:
+                cols['source'] = np.asarray(self.nodes[cols['source']])
+                cols['target'] = np.asarray(self.nodes[cols['target']])
+
+            frames += [pd.DataFrame(cols).assign(year=year, kind=kind)]
+
+        if not frames:
+            return pd.DataFrame(columns=self.columns + ['year', 'kind'])
+
+        edges = pd.concat(frames, axis=0, ignore_index=True)
+        edges['kind'] = edges['kind'].astype('category')
+
+        return edges
+
+
+def from_csvs(dat_ids, src_dir, dst, **kwargs):
+    # the per-block gzipped CSVs 5b used to write, deduplicated, as a store
+    nodes = pd.Series(np.arange(len(dat_ids)), index=dat_ids)
+
+    frames = {}
+    for root, dirs, files in os.walk(src_dir):
+        for name in tqdm(sorted(files)):
+            with gzip.open(os.path.join(root, name), 'rt') as f:
+                tmp = pd.read_csv(f)
+
+            if tmp.shape[0] == 0:
+                continue
+
+            tmp['year'] = tmp['year'].astype(int)
+            for (year, kind), grp in tmp.groupby(['year', 'kind']):
+                frames.setdefault((year, kind), []).append(pd.DataFrame({
+                    'source': nodes.loc[grp['source']].to_numpy(),
+                    'target': nodes.loc[grp['target']].to_numpy(),
+                    'sim': grp['sim'].to_numpy(),
+                }))
+
+    store = EdgeStore.create(dst, dat_ids, **kwargs)
+    for (year, kind), parts in frames.items():
+        # overlapping blocks wrote many pairs more than once
+        edges = pd.concat(parts, axis=0).drop_duplicates(['source', 'target'])
+        store.write_partition(year, kind, edges['source'], edges['target'],
+                              edges['sim'])
+
+    return store
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('dat', help='snippet data (.csv.gz), for the node ids')
+    parser.add_argument('src', help='directory of gzipped edge CSVs')
+    parser.add_argument('dst', help='edge store directory to write')
+    parser.add_argument('--sim-dtype', default='float32',
+                        choices=['float32', 'float16'], help='sim precision')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    fmt = '%(asctime)s : %(levelname)s : %(message)s'
+    logging.basicConfig(format=fmt, level=logging.INFO)
+
+    args = parse_args()
+
+    with gzip.open(args.dat, 'rt') as f:
+        dat_ids = pd.read_csv(f, usecols=['id'])['id'].to_numpy()
+
+    store = from_csvs(dat_ids, args.src, args.dst, sim_dtype=args.sim_dtype)
+    for part in store.manifest['partitions']:
+        logger.info(f'{part["year"]}-{part["kind"]}: {part["n_edges"]} edges')